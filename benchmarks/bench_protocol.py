@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+协议编解码微基准
+
+对protocol.py的generate_header / parse_response / FrameEncoder / FrameDecoder
+以及RealtimeDialogClient各请求构建方法计时，输出每秒操作数和每帧分配字节数。
+
+用法:
+    python benchmarks/bench_protocol.py                      # 测试local目录
+    python benchmarks/bench_protocol.py --target web --save results/web.json
+    python benchmarks/bench_protocol.py --compare results/web.json
+
+--save保存结果（含git commit），--compare与之前保存的结果逐项对比。
+"""
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+AUDIO_SIZES = (320, 3200, 16384, 65536)
+# 客户端用例每次run_until_complete内连续发送的帧数，摊薄事件循环本身的开销
+CLIENT_BATCH = 100
+SESSION_ID = "3f1c2a8e-6f0b-4c1e-9d2a-7b5e8c4d1a90"
+
+
+def build_server_frame(protocol, message_type, event, payload, serial_method, compression_type,
+                       session_id=SESSION_ID):
+    """按服务端格式构建一帧，用作parse_response的输入"""
+    frame = protocol.generate_header(message_type=message_type,
+                                     serial_method=serial_method,
+                                     compression_type=compression_type)
+    frame.extend(event.to_bytes(4, "big"))
+    frame.extend(len(session_id).to_bytes(4, "big"))
+    frame.extend(session_id.encode("utf-8"))
+    frame.extend(len(payload).to_bytes(4, "big"))
+    frame.extend(payload)
+    return bytes(frame)
+
+
+def build_json_frame(protocol, event, message):
+    payload = gzip.compress(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+    return build_server_frame(protocol, protocol.SERVER_FULL_RESPONSE, event, payload,
+                              protocol.JSON, protocol.GZIP)
+
+
+def build_error_frame(protocol):
+    payload = gzip.compress(json.dumps({"error": "DialogAudioIdleTimeoutError"}).encode("utf-8"))
+    frame = protocol.generate_header(message_type=protocol.SERVER_ERROR_RESPONSE)
+    frame.extend((45000001).to_bytes(4, "big"))
+    frame.extend(len(payload).to_bytes(4, "big"))
+    frame.extend(payload)
+    return bytes(frame)
+
+
+def measure_ops(fn, min_time):
+    """自适应循环次数，返回每秒操作数"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return number / elapsed
+        number *= 2 if elapsed < min_time / 10 else max(2, int(min_time / elapsed) + 1)
+
+
+def measure_alloc(fn, repeat=50):
+    """单次调用期间tracemalloc峰值增量的平均值（字节/次）"""
+    fn()
+    tracemalloc.start()
+    total = 0
+    try:
+        for _ in range(repeat):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return total / repeat
+
+
+class _DiscardSocket:
+    """丢弃所有发送内容，只用于计量客户端帧构建开销"""
+
+    async def send(self, data):
+        pass
+
+
+def protocol_cases(protocol):
+    cases = []
+
+    cases.append(("generate_header", lambda: protocol.generate_header()))
+
+    for size in AUDIO_SIZES:
+        frame = build_server_frame(protocol, protocol.SERVER_ACK, 352, os.urandom(size),
+                                   protocol.NO_SERIALIZATION, protocol.NO_COMPRESSION)
+        cases.append((f"parse_response audio352 {size}B",
+                      lambda frame=frame: protocol.parse_response(frame).payload))
+
+    json_frames = {
+        451: {"results": [{"text": "今天天气怎么样", "is_interim": True}]},
+        550: {"content": "今天北京晴，最高气温二十五度，适合出门散步。"},
+    }
+    for event, message in json_frames.items():
+        frame = build_json_frame(protocol, event, message)
+        cases.append((f"parse_response json{event} header",
+                      lambda frame=frame: protocol.parse_response(frame).event))
+        cases.append((f"parse_response json{event} payload",
+                      lambda frame=frame: protocol.parse_response(frame).payload))
+
+    error_frame = build_error_frame(protocol)
+    cases.append(("parse_response error", lambda: protocol.parse_response(error_frame).payload))
+
+    encoder = protocol.FrameEncoder(SESSION_ID)
+    for size in AUDIO_SIZES:
+        audio = os.urandom(size)
+        cases.append((f"FrameEncoder audio200 {size}B",
+                      lambda audio=audio: encoder.encode(200, audio,
+                                                         message_type=protocol.CLIENT_AUDIO_ONLY_REQUEST,
+                                                         serial_method=protocol.NO_SERIALIZATION,
+                                                         compression_type=protocol.NO_COMPRESSION)))
+
+    stream = b"".join(build_server_frame(protocol, protocol.SERVER_ACK, 352, os.urandom(3200),
+                                         protocol.NO_SERIALIZATION, protocol.NO_COMPRESSION)
+                      for _ in range(16))
+
+    def decode_chunks():
+        decoder = protocol.FrameDecoder()
+        for offset in range(0, len(stream), 4096):
+            decoder.feed(stream[offset:offset + 4096])
+
+    cases.append(("FrameDecoder 16x3200B in 4KB chunks", decode_chunks))
+    return cases
+
+
+def client_cases(client_module, protocol):
+    """
+    RealtimeDialogClient请求构建（发送到丢弃socket）
+    每个用例一次调用连续发送CLIENT_BATCH帧，结果按帧折算
+    """
+    client = client_module.RealtimeDialogClient(config={}, session_id=SESSION_ID)
+    client.ws = _DiscardSocket()
+    loop = asyncio.new_event_loop()
+    cases = []
+
+    def run(coro_fn):
+        async def batch():
+            for _ in range(CLIENT_BATCH):
+                await coro_fn()
+        return lambda: loop.run_until_complete(batch())
+
+    for size in AUDIO_SIZES:
+        audio = os.urandom(size)
+        cases.append((f"client.task_request {size}B", run(lambda audio=audio: client.task_request(audio))))
+    cases.append(("client.say_hello", run(client.say_hello)))
+    cases.append(("client.chat_tts_text", run(lambda: client.chat_tts_text(False, True, False, "你好"))))
+    cases.append(("client.finish_session", run(client.finish_session)))
+    return [(name, fn, CLIENT_BATCH) for name, fn in cases], loop
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmarks(target, min_time, with_client):
+    target_dir = ROOT_DIR / target
+    sys.path.insert(0, str(target_dir))
+    import protocol
+    import serialization
+
+    cases = protocol_cases(protocol)
+    loop = None
+    if with_client:
+        # config.py要求凭证环境变量，基准测试不建立连接，用占位值即可
+        os.environ.setdefault("X-Api-App-ID", "benchmark")
+        os.environ.setdefault("X-Api-Access-Key", "benchmark")
+        try:
+            import realtime_dialog_client
+        except ImportError as e:
+            print(f"跳过客户端请求构建基准: {e}")
+        else:
+            extra, loop = client_cases(realtime_dialog_client, protocol)
+            cases.extend(extra)
+
+    results = {}
+    try:
+        for case in cases:
+            name, fn = case[:2]
+            per_call = case[2] if len(case) > 2 else 1
+            # 客户端方法会打印请求内容，计时期间丢弃输出，避免测成终端I/O
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                ops = measure_ops(fn, min_time) * per_call
+                alloc = measure_alloc(fn) / per_call
+            results[name] = {"ops_per_sec": ops, "alloc_bytes_per_op": alloc}
+            print(f"{name:<42} {ops:>14,.0f} ops/s {alloc:>12,.0f} B/op")
+    finally:
+        if loop is not None:
+            loop.close()
+
+    return {
+        "target": target,
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "json_backend": serialization.BACKEND,
+        "results": results,
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n对比 {baseline_path} (commit {baseline.get('commit') or '?'}) -> 当前 (commit {current['commit'] or '?'})")
+    for name, result in current["results"].items():
+        old = baseline["results"].get(name)
+        if not old:
+            print(f"{name:<42} (新增)")
+            continue
+        speedup = result["ops_per_sec"] / old["ops_per_sec"] if old["ops_per_sec"] else float("inf")
+        alloc_delta = result["alloc_bytes_per_op"] - old["alloc_bytes_per_op"]
+        print(f"{name:<42} {speedup:>8.2f}x ops/s {alloc_delta:>+12,.0f} B/op")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="协议编解码微基准")
+    parser.add_argument("--target", default="local", choices=["local", "web", "webGoodluck"],
+                        help="被测代码目录")
+    parser.add_argument("--min-time", type=float, default=0.2, help="每项最少计时秒数")
+    parser.add_argument("--no-client", action="store_true", help="不测试RealtimeDialogClient请求构建")
+    parser.add_argument("--save", help="将结果保存为JSON文件")
+    parser.add_argument("--compare", help="与之前保存的JSON结果对比")
+    args = parser.parse_args()
+
+    current = run_benchmarks(args.target, args.min_time, not args.no_client)
+    if args.save:
+        save_path = Path(args.save)
+        save_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(save_path, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {save_path}")
+    if args.compare:
+        compare(current, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+web网关（/ws）并发负载测试
+
+模拟N个浏览器会话：连接/ws，发送start_dialog，按实时速率以audio_stream消息上传PCM音频
+（与前端一致：16kHz 16bit单声道，每条消息1024个采样），说完后继续发送静音，
+同时接收audio_stream / assistant_message等下行消息。
+
+统计吞吐量（消息数/字节数）、每轮从说话结束到首个音频、首个文本的延迟分位数，
+以及两个事件循环延迟：压测端延迟是本进程自己的事件循环，只用于判断压测端是否已成为瓶颈；
+网关延迟在结束时从网关的/metrics（doubao_event_loop_lag_seconds，最近一个统计窗口）抓取，
+用于评估web/app.py进程的容量。上游可以是真实服务，也可以是benchmarks/mock_server.py：
+
+    python benchmarks/mock_server.py --port 8765
+    DOUBAO_BASE_URL=ws://127.0.0.1:8765 python web/app.py
+    python benchmarks/load_ws.py --sessions 50 --turns 3 --audio local/input.pcm
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+import urllib.request
+import wave
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+
+import websockets
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+SAMPLE_RATE = 16000
+CHUNK_SAMPLES = 1024  # 前端ScriptProcessor每次回调的采样数
+
+
+def load_pcm(path, loops=1):
+    """读取16kHz 16bit单声道音频：WAV按头部解析，否则按裸PCM处理"""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    if head == b"RIFF":
+        with wave.open(str(path), "rb") as wf:
+            if wf.getframerate() != SAMPLE_RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+                raise ValueError(f"{path}: 需要16kHz 16bit单声道音频")
+            audio = wf.readframes(wf.getnframes())
+    else:
+        audio = Path(path).read_bytes()
+    return audio * loops
+
+
+def split_chunks(audio, chunk_bytes):
+    return [audio[i:i + chunk_bytes] for i in range(0, len(audio), chunk_bytes)]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def default_metrics_url(ws_url):
+    """ws://host:port/ws -> http://host:port/metrics"""
+    parts = urlsplit(ws_url)
+    scheme = "https" if parts.scheme == "wss" else "http"
+    return urlunsplit((scheme, parts.netloc, "/metrics", "", ""))
+
+
+def fetch_gateway_loop_lag(metrics_url, timeout=5.0):
+    """从网关/metrics读取事件循环延迟（秒），返回{"p50": .., "p90": .., "p99": .., "max": .., "slow_callbacks": ..}"""
+    with urllib.request.urlopen(metrics_url, timeout=timeout) as response:
+        text = response.read().decode("utf-8")
+    lag = {}
+    for line in text.splitlines():
+        if line.startswith('doubao_event_loop_lag_seconds{stat="'):
+            name, value = line.split(" ", 1)
+            lag[name[len('doubao_event_loop_lag_seconds{stat="'):-2]] = float(value)
+        elif line.startswith("doubao_event_loop_slow_callbacks_total "):
+            lag["slow_callbacks"] = int(float(line.split(" ", 1)[1]))
+    return lag
+
+
+class Stats:
+    """所有会话共享的计数器（单线程事件循环内更新，无需加锁）"""
+
+    def __init__(self):
+        self.sessions_started = 0
+        self.sessions_failed = 0
+        self.handshake = []
+        self.first_audio = []
+        self.first_text = []
+        self.turns = 0
+        self.turn_timeouts = 0
+        self.messages_out = 0
+        self.messages_in = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.audio_messages_in = 0
+        self.errors = 0
+        self.loop_lag = []
+        self.send_lag = []
+
+
+class LoadSession:
+    def __init__(self, index, options, chunks, silence, stats):
+        self.index = index
+        self.options = options
+        self.chunks = chunks
+        self.silence = silence
+        self.stats = stats
+        self.ws = None
+        self.turn_end_at = None
+        self.first_audio_at = None
+        self.first_text_at = None
+        self.last_audio_at = None
+        self.welcome = asyncio.Event()
+
+    async def send(self, message):
+        data = json.dumps(message)
+        await self.ws.send(data)
+        self.stats.messages_out += 1
+        self.stats.bytes_out += len(data)
+
+    async def receive_loop(self):
+        async for data in self.ws:
+            now = time.monotonic()
+            self.stats.messages_in += 1
+            self.stats.bytes_in += len(data)
+            message = json.loads(data)
+            kind = message.get("type")
+            if kind == "welcome":
+                self.welcome.set()
+            elif kind == "audio_stream":
+                self.stats.audio_messages_in += 1
+                self.last_audio_at = now
+                if self.turn_end_at is not None and self.first_audio_at is None:
+                    self.first_audio_at = now
+            elif kind in ("assistant_message", "assistant_message_update"):
+                if self.turn_end_at is not None and self.first_text_at is None:
+                    self.first_text_at = now
+            elif kind == "error":
+                self.stats.errors += 1
+
+    async def stream(self, chunks, until=None):
+        """按实时速率发送音频；until返回True时提前停止"""
+        chunk_seconds = CHUNK_SAMPLES / SAMPLE_RATE
+        started = time.monotonic()
+        for i, chunk in enumerate(chunks):
+            if until is not None and until():
+                return
+            due = started + i * chunk_seconds
+            now = time.monotonic()
+            if due > now:
+                await asyncio.sleep(due - now)
+            else:
+                self.stats.send_lag.append(now - due)
+            await self.send({"type": "audio_stream", "audio": chunk})
+
+    def _reply_finished(self):
+        if self.first_audio_at is None or self.first_text_at is None:
+            return False
+        return time.monotonic() - self.last_audio_at > self.options.reply_idle
+
+    async def run_turn(self):
+        self.turn_end_at = None
+        self.first_audio_at = None
+        self.first_text_at = None
+        await self.stream(self.chunks)
+        self.turn_end_at = time.monotonic()
+        # 说完后像浏览器一样继续发送静音，直到回复结束或超时
+        silence_chunks = int(self.options.turn_timeout * SAMPLE_RATE / CHUNK_SAMPLES)
+        await self.stream([self.silence] * silence_chunks, until=self._reply_finished)
+        self.stats.turns += 1
+        if self.first_audio_at is None and self.first_text_at is None:
+            self.stats.turn_timeouts += 1
+        if self.first_audio_at is not None:
+            self.stats.first_audio.append(self.first_audio_at - self.turn_end_at)
+        if self.first_text_at is not None:
+            self.stats.first_text.append(self.first_text_at - self.turn_end_at)
+
+    async def run(self):
+        await asyncio.sleep(self.options.ramp * self.index / max(1, self.options.sessions))
+        started = time.monotonic()
+        try:
+            async with websockets.connect(self.options.url, max_size=None) as ws:
+                self.ws = ws
+                receiver = asyncio.create_task(self.receive_loop())
+                await asyncio.wait_for(self.welcome.wait(), timeout=self.options.connect_timeout)
+                self.stats.handshake.append(time.monotonic() - started)
+                self.stats.sessions_started += 1
+                await self.send({"type": "start_dialog"})
+                for _ in range(self.options.turns):
+                    await self.run_turn()
+                    await asyncio.sleep(random.uniform(0, self.options.think_time))
+                await self.send({"type": "stop_dialog"})
+                receiver.cancel()
+        except Exception as e:
+            self.stats.sessions_failed += 1
+            print(f"session {self.index} failed: {e!r}")
+
+
+async def monitor_loop_lag(stats, interval=0.05):
+    """按固定间隔sleep，记录实际唤醒时间的超出量"""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(time.monotonic() - started - interval)
+
+
+def report(stats, elapsed, gateway_lag=None):
+    print(f"\n会话: 成功 {stats.sessions_started}, 失败 {stats.sessions_failed}, "
+          f"轮次 {stats.turns}, 超时 {stats.turn_timeouts}, 错误消息 {stats.errors}")
+    print(f"吞吐: 上行 {stats.messages_out / elapsed:.1f} msg/s {stats.bytes_out / elapsed / 1024:.1f} KB/s, "
+          f"下行 {stats.messages_in / elapsed:.1f} msg/s {stats.bytes_in / elapsed / 1024:.1f} KB/s "
+          f"(音频 {stats.audio_messages_in / elapsed:.1f} msg/s)")
+    print(f"{'(ms)':<20}{'n':>12}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}")
+    rows = [
+        ("握手(连接到welcome)", stats.handshake),
+        ("说话结束->首个音频", stats.first_audio),
+        ("说话结束->首个文本", stats.first_text),
+        ("压测端事件循环延迟", stats.loop_lag),
+        ("音频发送滞后", stats.send_lag),
+    ]
+    for name, values in rows:
+        print(f"{name:<20}{len(values):>12}" + "".join(
+            f"{format_ms(percentile(values, q)):>8}" for q in (50, 90, 99, 100)))
+    if gateway_lag:
+        print(f"{'网关事件循环延迟':<20}{'(/metrics)':>12}" + "".join(
+            f"{format_ms(gateway_lag.get(stat)):>8}" for stat in ("p50", "p90", "p99", "max"))
+              + f"  慢回调 {gateway_lag.get('slow_callbacks', '-')}")
+    else:
+        print("网关事件循环延迟: 未获取（见--metrics-url），以上事件循环延迟仅为压测端自身")
+    return {
+        "elapsed": elapsed,
+        "sessions_started": stats.sessions_started,
+        "sessions_failed": stats.sessions_failed,
+        "turns": stats.turns,
+        "turn_timeouts": stats.turn_timeouts,
+        "errors": stats.errors,
+        "messages_out_per_sec": stats.messages_out / elapsed,
+        "messages_in_per_sec": stats.messages_in / elapsed,
+        "bytes_out_per_sec": stats.bytes_out / elapsed,
+        "bytes_in_per_sec": stats.bytes_in / elapsed,
+        "latency": {name: {f"p{q}": percentile(values, q) for q in (50, 90, 99, 100)}
+                    for name, values in (("handshake", stats.handshake),
+                                         ("first_audio", stats.first_audio),
+                                         ("first_text", stats.first_text),
+                                         ("client_loop_lag", stats.loop_lag),
+                                         ("send_lag", stats.send_lag))},
+        "gateway_loop_lag": gateway_lag,
+    }
+
+
+async def run(options):
+    audio = load_pcm(options.audio, options.loops)
+    chunk_bytes = CHUNK_SAMPLES * 2
+    # base64只编码一次，所有会话共用
+    chunks = [base64.b64encode(chunk).decode("ascii") for chunk in split_chunks(audio, chunk_bytes)]
+    silence = base64.b64encode(bytes(chunk_bytes)).decode("ascii")
+    stats = Stats()
+    monitor = asyncio.create_task(monitor_loop_lag(stats))
+    started = time.monotonic()
+    await asyncio.gather(*(LoadSession(i, options, chunks, silence, stats).run()
+                           for i in range(options.sessions)))
+    monitor.cancel()
+    elapsed = time.monotonic() - started
+    gateway_lag = None
+    if options.metrics_url:
+        try:
+            gateway_lag = await asyncio.get_running_loop().run_in_executor(
+                None, fetch_gateway_loop_lag, options.metrics_url)
+        except Exception as e:
+            print(f"读取网关指标失败 ({options.metrics_url}): {e!r}")
+    return report(stats, elapsed, gateway_lag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="web网关/ws并发负载测试")
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--sessions", type=int, default=10, help="并发会话数")
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的对话轮数")
+    parser.add_argument("--audio", default=str(ROOT_DIR / "local" / "input.pcm"),
+                        help="每轮上传的16kHz 16bit单声道PCM/WAV文件")
+    parser.add_argument("--loops", type=int, default=5, help="每轮把音频文件重复几遍")
+    parser.add_argument("--ramp", type=float, default=5.0, help="在多少秒内逐步建立全部会话")
+    parser.add_argument("--think-time", type=float, default=1.0, help="两轮之间的最大随机间隔（秒）")
+    parser.add_argument("--turn-timeout", type=float, default=15.0, help="等待回复的最长时间（秒）")
+    parser.add_argument("--reply-idle", type=float, default=1.0, help="音频停止多久视为回复结束（秒）")
+    parser.add_argument("--connect-timeout", type=float, default=15.0)
+    parser.add_argument("--metrics-url", help="网关Prometheus指标地址，默认由--url推出；传空字符串不抓取")
+    parser.add_argument("--json", help="将结果保存为JSON文件")
+    options = parser.parse_args()
+    if options.metrics_url is None:
+        options.metrics_url = default_metrics_url(options.url)
+
+    result = asyncio.run(run(options))
+    if options.json:
+        with open(options.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {options.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+本地模拟豆包实时对话服务端
+
+按protocol.py的二进制协议收发帧，无需凭证和外网即可对RealtimeDialogClient、
+DialogSession以及web网关做功能验证、基准测试和容量测试。
+
+支持StartConnection / StartSession / SayHello / ChatTTSText / TaskRequest /
+FinishSession / FinishConnection。对TaskRequest音频做简单的能量VAD：
+检测到说话发送450，说话期间周期性发送451，静音超过--end-silence-ms后发送459，
+随后依次发送350、550、352（float32 24kHz TTS音频）、351、559、359。
+
+用法:
+    python benchmarks/mock_server.py --port 8765
+    DOUBAO_BASE_URL=ws://127.0.0.1:8765 python local/main.py
+
+可配置事件延迟与抖动、TTS帧大小与发送速率，以及按轮次注入服务端错误或直接断开连接。
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import math
+import random
+import sys
+import time
+import uuid
+from array import array
+from pathlib import Path
+
+import websockets
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+TTS_SAMPLE_RATE = 24000
+ASR_TEXT = "今天天气怎么样"
+REPLY_TEXT = ("今天天气晴朗，", "最高气温二十五度，", "适合出门散步。")
+
+
+def parse_client_frame(protocol, data):
+    """解析客户端帧，返回(message_type, event, session_id, payload)；payload已解压、JSON已反序列化"""
+    buf = memoryview(data)
+    header_size = buf[0] & 0x0f
+    message_type = buf[1] >> 4
+    flags = buf[1] & 0x0f
+    serialization_method = buf[2] >> 4
+    compression = buf[2] & 0x0f
+    offset = header_size * 4
+    if flags & protocol.NEG_SEQUENCE > 0:
+        offset += 4
+    event = None
+    if flags & protocol.MSG_WITH_EVENT > 0:
+        event = int.from_bytes(buf[offset:offset + 4], "big")
+        offset += 4
+    session_id = ""
+    if event not in protocol.CLIENT_CONNECTION_EVENTS:
+        size = int.from_bytes(buf[offset:offset + 4], "big")
+        offset += 4
+        session_id = str(buf[offset:offset + size], "utf-8")
+        offset += size
+    size = int.from_bytes(buf[offset:offset + 4], "big")
+    payload = bytes(buf[offset + 4:offset + 4 + size])
+    if compression == protocol.GZIP:
+        payload = gzip.decompress(payload)
+    if serialization_method == protocol.JSON:
+        payload = json.loads(payload) if payload else {}
+    return message_type, event, session_id, payload
+
+
+def build_frame(protocol, event, payload, session_id="", message_type=None):
+    """
+    构建服务端帧：dict按JSON+gzip编码，bytes作为SERVER_ACK音频原样发送
+    与真实服务一致，服务端帧总是带ID字段：会话事件为session ID，连接事件（50/51/52）为connect ID
+    """
+    if isinstance(payload, (bytes, bytearray)):
+        frame = protocol.generate_header(message_type=message_type or protocol.SERVER_ACK,
+                                         serial_method=protocol.NO_SERIALIZATION,
+                                         compression_type=protocol.NO_COMPRESSION)
+        body = payload
+    else:
+        frame = protocol.generate_header(message_type=message_type or protocol.SERVER_FULL_RESPONSE)
+        body = gzip.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+    frame.extend(event.to_bytes(4, "big"))
+    session_bytes = session_id.encode("utf-8")
+    frame.extend(len(session_bytes).to_bytes(4, "big"))
+    frame.extend(session_bytes)
+    frame.extend(len(body).to_bytes(4, "big"))
+    frame.extend(body)
+    return bytes(frame)
+
+
+def build_error_frame(protocol, code, message):
+    body = gzip.compress(json.dumps({"error": message}).encode("utf-8"))
+    frame = protocol.generate_header(message_type=protocol.SERVER_ERROR_RESPONSE)
+    frame.extend(code.to_bytes(4, "big"))
+    frame.extend(len(body).to_bytes(4, "big"))
+    frame.extend(body)
+    return bytes(frame)
+
+
+def request_header(ws, name):
+    """读取握手请求头，兼容新旧两套websockets API"""
+    request = getattr(ws, "request", None)
+    headers = request.headers if request is not None else getattr(ws, "request_headers", None)
+    return headers.get(name) if headers is not None else None
+
+
+def tone(duration_ms, frequency=440.0, volume=0.2):
+    """生成一段float32单声道正弦音（24kHz），作为TTS音频帧内容"""
+    samples = int(TTS_SAMPLE_RATE * duration_ms / 1000)
+    step = 2 * math.pi * frequency / TTS_SAMPLE_RATE
+    return array("f", (volume * math.sin(step * i) for i in range(samples))).tobytes()
+
+
+def peak_amplitude(audio):
+    """16bit PCM峰值幅度"""
+    samples = array("h")
+    samples.frombytes(audio[:len(audio) - len(audio) % 2])
+    if not samples:
+        return 0
+    return max(max(samples), -min(samples))
+
+
+class MockSession:
+    """单个对话会话的状态：VAD、当前轮次和正在发送的回复"""
+
+    def __init__(self, server, connection, session_id):
+        self.server = server
+        self.connection = connection
+        self.session_id = session_id
+        self.dialog_id = str(uuid.uuid4())
+        self.speaking = False
+        self.speech_ms = 0.0
+        self.last_asr_ms = 0.0
+        self.last_voice_at = 0.0
+        self.silence_timer = None
+        self.silence_task = None
+        self.reply_task = None
+        self.turns = 0
+
+    async def send(self, event, payload):
+        await self.connection.send(event, payload, self.session_id)
+
+    async def on_audio(self, audio):
+        options = self.server.options
+        duration_ms = len(audio) / (options.input_sample_rate * 2) * 1000
+        if peak_amplitude(audio) >= options.vad_threshold:
+            self.last_voice_at = time.monotonic()
+            if not self.speaking:
+                self.speaking = True
+                self.speech_ms = 0.0
+                self.last_asr_ms = 0.0
+                if self.reply_task and not self.reply_task.done():
+                    # 用户打断：停止当前回复
+                    self.reply_task.cancel()
+                await self.send(450, {"question_id": str(uuid.uuid4())})
+            self.speech_ms += duration_ms
+            if self.speech_ms - self.last_asr_ms >= options.asr_interval_ms:
+                self.last_asr_ms = self.speech_ms
+                text = ASR_TEXT[:max(1, int(self.speech_ms / options.asr_interval_ms))]
+                await self.send(451, {"results": [{"text": text, "is_interim": True}]})
+            self._arm_silence_timer()
+        elif self.speaking and (time.monotonic() - self.last_voice_at) * 1000 >= options.end_silence_ms:
+            await self.end_of_speech()
+
+    def _arm_silence_timer(self):
+        """客户端停止发送音频时也按静音处理"""
+        if self.silence_timer:
+            self.silence_timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.silence_timer = loop.call_later(self.server.options.end_silence_ms / 1000, self._on_silence_timeout)
+
+    def _on_silence_timeout(self):
+        self.silence_timer = None
+        # 事件循环只弱引用任务，需自己持有
+        self.silence_task = asyncio.ensure_future(self.end_of_speech())
+
+    async def end_of_speech(self):
+        if not self.speaking:
+            return
+        self.speaking = False
+        if self.silence_timer:
+            self.silence_timer.cancel()
+            self.silence_timer = None
+        await self.send(451, {"results": [{"text": ASR_TEXT, "is_interim": False}]})
+        await self.send(459, {})
+        self.start_reply(REPLY_TEXT, "default")
+
+    def start_reply(self, texts, tts_type):
+        if self.reply_task and not self.reply_task.done():
+            self.reply_task.cancel()
+        self.reply_task = asyncio.create_task(self.reply(texts, tts_type))
+
+    async def reply(self, texts, tts_type):
+        options = self.server.options
+        self.turns += 1
+        if random.random() < options.error_rate:
+            await self.connection.send_raw(build_error_frame(self.server.protocol, 52000042, "MockInjectedError"))
+            return
+        if random.random() < options.drop_rate:
+            await self.connection.abort()
+            return
+        await asyncio.sleep(options.llm_latency_ms / 1000)
+        for text in texts:
+            await self.send(350, {"tts_type": tts_type, "text": text})
+            if tts_type == "default":
+                await self.send(550, {"content": text})
+            frames = max(1, int(len(text) * options.ms_per_char / options.tts_frame_ms))
+            for _ in range(frames):
+                await self.send(352, self.server.tts_frame)
+                await asyncio.sleep(options.tts_frame_ms / 1000 / options.tts_speed)
+            await self.send(351, {"tts_type": tts_type})
+        if tts_type == "default":
+            await self.send(559, {})
+        await self.send(359, {"tts_type": tts_type})
+
+    def close(self):
+        if self.silence_timer:
+            self.silence_timer.cancel()
+        if self.silence_task and not self.silence_task.done():
+            self.silence_task.cancel()
+        if self.reply_task and not self.reply_task.done():
+            self.reply_task.cancel()
+
+
+class MockConnection:
+    """单条WebSocket连接，可承载多个会话；下行帧加上注入的延迟与抖动后按顺序发送"""
+
+    def __init__(self, server, ws):
+        self.server = server
+        self.ws = ws
+        self.connect_id = request_header(ws, "X-Api-Connect-Id") or str(uuid.uuid4())
+        self.sessions = {}
+        self.chat_tts_text = {}
+        self._outbox = asyncio.Queue()
+        self._last_deliver_at = 0.0
+        self._writer = asyncio.create_task(self._write_loop())
+
+    async def send(self, event, payload, session_id=""):
+        await self.send_raw(build_frame(self.server.protocol, event, payload, session_id))
+
+    async def send_raw(self, frame):
+        options = self.server.options
+        delay = (options.latency_ms + random.uniform(0, options.jitter_ms)) / 1000
+        # 抖动只推迟发送，不打乱帧的顺序
+        deliver_at = max(time.monotonic() + delay, self._last_deliver_at)
+        self._last_deliver_at = deliver_at
+        self._outbox.put_nowait((deliver_at, frame))
+
+    async def _write_loop(self):
+        while True:
+            deliver_at, frame = await self._outbox.get()
+            delay = deliver_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                await self.ws.send(frame)
+            except websockets.ConnectionClosed:
+                return
+            self.server.frames_sent += 1
+            self.server.bytes_sent += len(frame)
+
+    async def abort(self):
+        """模拟网络中断：不发送close帧直接断开"""
+        self.server.drops += 1
+        transport = getattr(self.ws, "transport", None)
+        if transport is not None:
+            transport.abort()
+        else:
+            await self.ws.close()
+
+    async def handle(self, message):
+        protocol = self.server.protocol
+        _, event, session_id, payload = parse_client_frame(protocol, message)
+        if event == 1:
+            await self.send(50, {}, self.connect_id)
+        elif event == 2:
+            await self.send(52, {}, self.connect_id)
+        elif event == 100:
+            session = MockSession(self.server, self, session_id)
+            if isinstance(payload, dict) and payload.get("dialog", {}).get("dialog_id"):
+                session.dialog_id = payload["dialog"]["dialog_id"]
+            self.sessions[session_id] = session
+            await self.send(150, {"dialog_id": session.dialog_id}, session_id)
+        elif event == 102:
+            session = self.sessions.pop(session_id, None)
+            if session:
+                session.close()
+            await self.send(152, {}, session_id)
+        elif event == 200:
+            session = self.sessions.get(session_id)
+            if session:
+                await session.on_audio(payload)
+        elif event == 300:
+            session = self.sessions.get(session_id)
+            if session:
+                session.start_reply((payload.get("content", ""),), "chat_tts_text")
+        elif event == 500:
+            session = self.sessions.get(session_id)
+            if session:
+                parts = self.chat_tts_text.setdefault(session_id, [])
+                parts.append(payload.get("content", ""))
+                if payload.get("end"):
+                    session.start_reply(("".join(self.chat_tts_text.pop(session_id)),), "chat_tts_text")
+        else:
+            await self.send_raw(build_error_frame(protocol, 45000000, f"unsupported event {event}"))
+
+    def close(self):
+        self._writer.cancel()
+        for session in self.sessions.values():
+            session.close()
+        self.sessions.clear()
+
+
+class MockServer:
+    def __init__(self, protocol, options):
+        self.protocol = protocol
+        self.options = options
+        self.tts_frame = tone(options.tts_frame_ms)
+        self.connections = 0
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.drops = 0
+
+    async def handler(self, ws, *_):
+        self.connections += 1
+        connection = MockConnection(self, ws)
+        try:
+            async for message in ws:
+                if isinstance(message, str):
+                    continue
+                self.frames_received += 1
+                await connection.handle(message)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            connection.close()
+            self.connections -= 1
+
+    async def report(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(f"connections={self.connections} frames_in={self.frames_received} "
+                  f"frames_out={self.frames_sent} bytes_out={self.bytes_sent} drops={self.drops}")
+
+
+async def serve(options):
+    sys.path.insert(0, str(ROOT_DIR / options.target))
+    import protocol
+
+    server = MockServer(protocol, options)
+    async with websockets.serve(server.handler, options.host, options.port, max_size=None):
+        print(f"mock server listening on ws://{options.host}:{options.port}")
+        if options.report_interval > 0:
+            await server.report(options.report_interval)
+        else:
+            await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟豆包实时对话服务端")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--target", default="local", choices=["local", "web", "webGoodluck"],
+                        help="使用哪个目录的protocol.py")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="每个下行帧的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="每个下行帧额外的随机延迟上限")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0, help="459之后到首个回复的时间")
+    parser.add_argument("--tts-frame-ms", type=float, default=40.0, help="每个352音频帧的时长")
+    parser.add_argument("--tts-speed", type=float, default=2.0, help="TTS音频相对实时的发送倍速")
+    parser.add_argument("--ms-per-char", type=float, default=200.0, help="每个字对应的TTS音频时长")
+    parser.add_argument("--input-sample-rate", type=int, default=16000, help="上行16bit PCM采样率")
+    parser.add_argument("--vad-threshold", type=int, default=500, help="判定为说话的16bit峰值幅度")
+    parser.add_argument("--asr-interval-ms", type=float, default=400.0, help="说话期间451的间隔")
+    parser.add_argument("--end-silence-ms", type=float, default=600.0, help="静音多久判定说话结束")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="每轮回复返回服务端错误的概率")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="每轮回复直接断开连接的概率")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="统计输出间隔（秒），0为不输出")
+    options = parser.parse_args()
+    try:
+        asyncio.run(serve(options))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
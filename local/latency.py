@@ -0,0 +1,159 @@
+"""
+对话轮次延迟时间线
+按服务端事件为每一轮对话打时间点，轮次结束时输出各阶段耗时，并汇总到进程级直方图。
+
+时间点:
+    speech_start    450 检测到用户开始说话（开始新一轮）
+    last_asr        最后一个451 ASR结果
+    speech_end      459 用户说话结束
+    first_text      首个550 LLM回复文本
+    first_audio     首个352 TTS音频帧
+    tts_end         359 TTS结束（结束本轮）
+    text_forwarded  首个文本转发给浏览器（web）
+    audio_forwarded 首个音频转发给浏览器（web）
+"""
+import bisect
+import time
+from typing import Callable, Dict, List, Optional
+
+import serialization
+
+EVENT_POINTS = {
+    450: "speech_start",
+    451: "last_asr",
+    459: "speech_end",
+    550: "first_text",
+    352: "first_audio",
+    359: "tts_end",
+}
+# 同一轮内只记录第一次的时间点
+FIRST_ONLY = frozenset(("first_text", "first_audio", "text_forwarded", "audio_forwarded"))
+
+# 阶段耗时 = 终点 - 起点
+STAGES = (
+    ("speech", "speech_start", "speech_end"),
+    ("asr_tail", "last_asr", "speech_end"),
+    ("first_text", "speech_end", "first_text"),
+    ("first_audio", "speech_end", "first_audio"),
+    ("tts", "first_audio", "tts_end"),
+    ("text_forward", "first_text", "text_forwarded"),
+    ("audio_forward", "first_audio", "audio_forwarded"),
+    ("end_to_end_audio", "speech_end", "audio_forwarded"),
+)
+
+# 直方图桶上界（毫秒）
+DEFAULT_BUCKETS_MS = (5, 10, 25, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+
+
+class Histogram:
+    """固定桶直方图，observe只做一次二分查找和计数"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        self.buckets = tuple(bucket / 1000 for bucket in buckets_ms)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """按桶上界估算分位数（秒），超出最大桶时返回inf"""
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+# 进程级各阶段耗时直方图，所有会话共享
+histograms: Dict[str, Histogram] = {name: Histogram() for name, _, _ in STAGES}
+
+
+def format_histograms() -> str:
+    """各阶段耗时分位数汇总（毫秒，按桶上界估算）"""
+    lines = [f"{'stage':<18}{'n':>6}{'avg':>8}{'p50':>8}{'p90':>8}{'p99':>8}"]
+    for name, histogram in histograms.items():
+        if not histogram.count:
+            continue
+        values = [histogram.sum / histogram.count] + [histogram.percentile(q) for q in (50, 90, 99)]
+        lines.append(f"{name:<18}{histogram.count:>6}" + "".join(f"{value * 1000:>8.0f}" for value in values))
+    return "\n".join(lines)
+
+
+class LatencyTimeline:
+    """
+    单个会话的轮次时间线
+    on_event由事件分发调用，mark用于记录转发等客户端侧时间点。
+    export_path不为空时每轮结束追加一行JSON。
+    """
+
+    def __init__(self, session_id: str, export_path: Optional[str] = None,
+                 log: Callable[[str], None] = print):
+        self.session_id = session_id
+        self.export_path = export_path
+        self.log = log
+        self.turn = 0
+        self.points: Dict[str, float] = {}
+        self.started_at = 0.0
+        self.completed: List[Dict[str, float]] = []
+
+    def on_event(self, frame) -> None:
+        point = EVENT_POINTS.get(frame.event)
+        if point is not None:
+            self.mark(point)
+
+    def mark(self, point: str) -> None:
+        if point == "speech_start":
+            if self.points:
+                # 上一轮尚未结束就开始说话（打断）
+                self.finish(interrupted=True)
+            self.turn += 1
+            self.started_at = time.time()
+        elif not self.points:
+            # 没有450开头的轮次（如SayHello）不统计
+            return
+        if point in FIRST_ONLY and point in self.points:
+            return
+        self.points[point] = time.monotonic()
+        if point == "tts_end":
+            self.finish()
+
+    def finish(self, interrupted: bool = False) -> Optional[Dict[str, float]]:
+        """结束当前轮次，输出各阶段耗时并计入直方图"""
+        if not self.points:
+            return None
+        points, self.points = self.points, {}
+        stages = {}
+        for name, start, end in STAGES:
+            if start in points and end in points:
+                stages[name] = points[end] - points[start]
+                histograms[name].observe(stages[name])
+        self.completed.append(stages)
+        self.log(f"turn {self.turn} latency (ms): " + ", ".join(
+            f"{name}={value * 1000:.0f}" for name, value in stages.items()) + (" [interrupted]" if interrupted else ""))
+        if self.export_path:
+            self._export(points, stages, interrupted)
+        return stages
+
+    def _export(self, points: Dict[str, float], stages: Dict[str, float], interrupted: bool) -> None:
+        base = points["speech_start"]
+        record = {
+            "session_id": self.session_id,
+            "turn": self.turn,
+            "started_at": self.started_at,
+            "interrupted": interrupted,
+            "points_ms": {name: round((value - base) * 1000, 1) for name, value in points.items()},
+            "stages_ms": {name: round(value * 1000, 1) for name, value in stages.items()},
+        }
+        try:
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(serialization.dumps_str(record) + "\n")
+        except OSError as e:
+            self.log(f"latency export failed: {e}")
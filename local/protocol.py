@@ -1,5 +1,8 @@
 import gzip
-import json
+import struct
+import zlib
+
+import serialization
 
 PROTOCOL_VERSION = 0b0001
 DEFAULT_HEADER_SIZE = 0b0001
@@ -39,6 +42,22 @@ NO_COMPRESSION = 0b0000
 GZIP = 0b0001
 CUSTOM_COMPRESSION = 0b1111
 
+# 客户端连接级事件（StartConnection/FinishConnection）不携带session ID
+CLIENT_CONNECTION_EVENTS = frozenset((1, 2))
+# 服务端连接级事件（ConnectionStarted/ConnectionFailed/ConnectionFinished）的ID字段是connect ID而非session ID
+SERVER_CONNECTION_EVENTS = frozenset((50, 51, 52))
+
+# 帧内定长字段（大端）
+_UINT32 = struct.Struct(">I")
+_INT32 = struct.Struct(">i")
+_ERROR_PREFIX = struct.Struct(">II")  # error code + payload size
+
+_MESSAGE_TYPE_NAMES = {
+    SERVER_FULL_RESPONSE: 'SERVER_FULL_RESPONSE',
+    SERVER_ACK: 'SERVER_ACK',
+    SERVER_ERROR_RESPONSE: 'SERVER_ERROR_RESPONSE',
+}
+
 
 def generate_header(
         version=PROTOCOL_VERSION,
@@ -66,6 +85,78 @@ def generate_header(
     return header
 
 
+def decode_payload(payload, serialization_method, message_compression):
+    """按header中的压缩和序列化方式还原payload"""
+    if message_compression == GZIP:
+        payload = gzip.decompress(payload)
+    if serialization_method == JSON:
+        payload = serialization.loads(payload)
+    elif serialization_method != NO_SERIALIZATION:
+        payload = str(payload, "utf-8")
+    return payload
+
+
+class ParsedFrame:
+    """
+    解析后的服务端帧
+    header字段（message_type、event、session_id等）解析时即可用；
+    payload在首次访问时才解压、反序列化，结果会被缓存。
+    兼容原先的dict用法：支持get()、[]和in，payload对应键'payload_msg'。
+    """
+    __slots__ = ('message_type', 'serialization_method', 'message_compression',
+                 'seq', 'event', 'session_id', 'connect_id', 'code', 'payload_size', 'error',
+                 'raw_payload', '_payload', '_decoded')
+
+    _KEYS = ('message_type', 'seq', 'event', 'session_id', 'connect_id', 'code', 'payload_msg', 'payload_size',
+             'error')
+
+    def __init__(self, message_type, serialization_method=NO_SERIALIZATION, message_compression=NO_COMPRESSION):
+        self.message_type = message_type
+        self.serialization_method = serialization_method
+        self.message_compression = message_compression
+        self.seq = None
+        self.event = None
+        self.session_id = None
+        self.connect_id = None
+        self.code = None
+        self.payload_size = None
+        self.error = None
+        self.raw_payload = None
+        self._payload = None
+        self._decoded = False
+
+    @property
+    def payload(self):
+        """解码后的payload：dict（JSON）、str或音频数据（bytes/memoryview）"""
+        if not self._decoded:
+            if self.raw_payload is not None:
+                self._payload = decode_payload(self.raw_payload, self.serialization_method,
+                                               self.message_compression)
+            self._decoded = True
+        return self._payload
+
+    def get(self, key, default=None):
+        if key not in self._KEYS:
+            return default
+        value = self.payload if key == 'payload_msg' else getattr(self, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def to_dict(self):
+        return {key: self.get(key) for key in self._KEYS if key in self}
+
+    def __repr__(self):
+        return f"ParsedFrame({self.to_dict()})"
+
+
 def parse_response(res):
     """
     - header
@@ -79,57 +170,277 @@ def parse_response(res):
         - (8bits) reserve
     - payload
         - [optional 4 bytes] event
-        - [optional] session ID
+        - session ID（事件50/51/52为connect ID）
           -- (4 bytes)session ID len
           -- session ID data
         - (4 bytes)data len
         - data
+
+    基于memoryview按偏移量原地解析，不复制帧数据，返回ParsedFrame；
+    payload延迟解码，未压缩且无序列化的音频数据以memoryview形式返回。
+    文本消息返回None。
     """
     if isinstance(res, str):
-        return {}
-    protocol_version = res[0] >> 4
-    header_size = res[0] & 0x0f
-    message_type = res[1] >> 4
-    message_type_specific_flags = res[1] & 0x0f
-    serialization_method = res[2] >> 4
-    message_compression = res[2] & 0x0f
-    reserved = res[3]
-    header_extensions = res[4:header_size * 4]
-    payload = res[header_size * 4:]
-    result = {}
-    payload_msg = None
-    payload_size = 0
-    start = 0
+        return None
+    buf = memoryview(res)
+    header_size = buf[0] & 0x0f
+    message_type = buf[1] >> 4
+    message_type_specific_flags = buf[1] & 0x0f
+    offset = header_size * 4
+    frame = ParsedFrame(_MESSAGE_TYPE_NAMES.get(message_type, f'UNKNOWN ({message_type})'),
+                        serialization_method=buf[2] >> 4,
+                        message_compression=buf[2] & 0x0f)
     if message_type == SERVER_FULL_RESPONSE or message_type == SERVER_ACK:
-        result['message_type'] = 'SERVER_FULL_RESPONSE'
-        if message_type == SERVER_ACK:
-            result['message_type'] = 'SERVER_ACK'
         if message_type_specific_flags & NEG_SEQUENCE > 0:
-            result['seq'] = int.from_bytes(payload[:4], "big", signed=False)
-            start += 4
+            frame.seq = _UINT32.unpack_from(buf, offset)[0]
+            offset += 4
         if message_type_specific_flags & MSG_WITH_EVENT > 0:
-            result['event'] = int.from_bytes(payload[:4], "big", signed=False)
-            start += 4
-        payload = payload[start:]
-        session_id_size = int.from_bytes(payload[:4], "big", signed=True)
-        session_id = payload[4:session_id_size+4]
-        result['session_id'] = str(session_id)
-        payload = payload[4 + session_id_size:]
-        payload_size = int.from_bytes(payload[:4], "big", signed=False)
-        payload_msg = payload[4:]
+            frame.event = _UINT32.unpack_from(buf, offset)[0]
+            offset += 4
+        session_id_size = _INT32.unpack_from(buf, offset)[0]
+        offset += 4
+        session_id = str(buf[offset:offset + session_id_size], "utf-8")
+        if frame.event in SERVER_CONNECTION_EVENTS:
+            frame.connect_id = session_id
+        else:
+            frame.session_id = session_id
+        offset += session_id_size
+        frame.payload_size = _UINT32.unpack_from(buf, offset)[0]
+        frame.raw_payload = buf[offset + 4:]
     elif message_type == SERVER_ERROR_RESPONSE:
-        code = int.from_bytes(payload[:4], "big", signed=False)
-        result['code'] = code
-        payload_size = int.from_bytes(payload[4:8], "big", signed=False)
-        payload_msg = payload[8:]
-    if payload_msg is None:
-        return result
-    if message_compression == GZIP:
-        payload_msg = gzip.decompress(payload_msg)
-    if serialization_method == JSON:
-        payload_msg = json.loads(str(payload_msg, "utf-8"))
-    elif serialization_method != NO_SERIALIZATION:
-        payload_msg = str(payload_msg, "utf-8")
-    result['payload_msg'] = payload_msg
-    result['payload_size'] = payload_size
-    return result
+        frame.code, frame.payload_size = _ERROR_PREFIX.unpack_from(buf, offset)
+        frame.raw_payload = buf[offset + 8:]
+    return frame
+
+
+class FrameEncoder:
+    """
+    会话级客户端帧编码器
+    header、event、session ID长度及内容按消息类型编码一次后缓存，
+    之后每帧只需写入payload长度和payload本身。
+    帧在内部复用的缓冲区中组装，返回的memoryview在下一次encode前有效，
+    调用方应在编码后立即发送。
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self._session_id_bytes = session_id.encode("utf-8")
+        self._prefixes = {}
+        self._buffer = bytearray(256)
+        self._buffer_prefix = None
+
+    def prefix(self, event: int, message_type=CLIENT_FULL_REQUEST, serial_method=JSON,
+               compression_type=GZIP, with_session=True) -> bytes:
+        """返回（并缓存）header + event [+ session ID长度 + session ID]"""
+        key = (event, message_type, serial_method, compression_type, with_session)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            header = generate_header(message_type=message_type,
+                                     serial_method=serial_method,
+                                     compression_type=compression_type)
+            header.extend(_UINT32.pack(event))
+            if with_session:
+                header.extend(_UINT32.pack(len(self._session_id_bytes)))
+                header.extend(self._session_id_bytes)
+            prefix = bytes(header)
+            self._prefixes[key] = prefix
+        return prefix
+
+    def encode(self, event: int, payload: bytes, message_type=CLIENT_FULL_REQUEST, serial_method=JSON,
+               compression_type=GZIP, with_session=True) -> memoryview:
+        """组装一帧：缓存的前缀 + (4 bytes)payload长度 + payload"""
+        prefix = self.prefix(event, message_type, serial_method, compression_type, with_session)
+        prefix_size = len(prefix)
+        payload_size = len(payload)
+        frame_size = prefix_size + 4 + payload_size
+        buf = self._buffer
+        if frame_size > len(buf):
+            # 不原地扩容：上一帧的memoryview可能仍被持有
+            buf = self._buffer = bytearray(max(frame_size, len(buf) * 2))
+            self._buffer_prefix = None
+        # 通过memoryview写入，避免bytearray切片赋值时对bytes先做一次临时拷贝
+        view = memoryview(buf)
+        if self._buffer_prefix is not prefix:
+            view[:prefix_size] = prefix
+            self._buffer_prefix = prefix
+        _UINT32.pack_into(buf, prefix_size, payload_size)
+        view[prefix_size + 4:frame_size] = payload
+        return view[:frame_size]
+
+
+class Compressor:
+    """
+    单一消息类型的压缩器
+    method: "none" 不压缩 | "gzip" 按level压缩 | "zlib" 原始zlib流（CUSTOM_COMPRESSION）
+    adaptive为True时，每sample_interval帧采样一次压缩率，
+    节省比例低于min_saving时自动关闭压缩，后续采样恢复后再开启。
+    """
+
+    def __init__(self, method="gzip", level=6, adaptive=False, min_saving=0.05, sample_interval=50):
+        if method not in ("none", "gzip", "zlib"):
+            raise ValueError(f"Unsupported compression method: {method}")
+        self.method = method
+        self.level = level
+        self.adaptive = adaptive
+        self.min_saving = min_saving
+        self.sample_interval = sample_interval
+        self.enabled = method != "none"
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self._frames = 0
+
+    def _compress(self, data):
+        if self.method == "gzip":
+            return GZIP, gzip.compress(data, compresslevel=self.level)
+        return CUSTOM_COMPRESSION, zlib.compress(data, self.level)
+
+    def compress(self, data):
+        """返回 (compression_type, payload)"""
+        self.raw_bytes += len(data)
+        if self.method == "none":
+            self.compressed_bytes += len(data)
+            return NO_COMPRESSION, data
+        if self.adaptive:
+            sampling = self._frames % self.sample_interval == 0
+            self._frames += 1
+            if not sampling and not self.enabled:
+                self.compressed_bytes += len(data)
+                return NO_COMPRESSION, data
+            compression_type, payload = self._compress(data)
+            if sampling and data:
+                self.enabled = 1 - len(payload) / len(data) >= self.min_saving
+            if len(payload) >= len(data):
+                # 采样只用于衡量压缩率，压缩后没有变小就发送原始数据
+                self.compressed_bytes += len(data)
+                return NO_COMPRESSION, data
+        else:
+            compression_type, payload = self._compress(data)
+        self.compressed_bytes += len(payload)
+        return compression_type, payload
+
+
+def _frame_length(buf, offset):
+    """
+    根据帧内的长度字段计算从offset起完整帧的字节数，数据不足时返回None
+    header长度为0或ID长度为负数的帧无法定界，抛出ValueError
+    """
+    end = len(buf)
+    if end - offset < 4:
+        return None
+    header_size = buf[offset] & 0x0f
+    if header_size == 0:
+        raise ValueError("Invalid frame: header size is 0")
+    message_type = buf[offset + 1] >> 4
+    message_type_specific_flags = buf[offset + 1] & 0x0f
+    pos = offset + header_size * 4
+    if message_type == SERVER_ERROR_RESPONSE:
+        pos += 4  # error code
+    else:
+        if message_type_specific_flags & NEG_SEQUENCE > 0:
+            pos += 4
+        event = None
+        if message_type_specific_flags & MSG_WITH_EVENT > 0:
+            if end < pos + 4:
+                return None
+            event = _UINT32.unpack_from(buf, pos)[0]
+            pos += 4
+        # 只有客户端的StartConnection/FinishConnection没有ID字段，服务端帧总是带session ID或connect ID
+        client_frame = message_type in (CLIENT_FULL_REQUEST, CLIENT_AUDIO_ONLY_REQUEST)
+        if not (client_frame and event in CLIENT_CONNECTION_EVENTS):
+            if end < pos + 4:
+                return None
+            id_size = _INT32.unpack_from(buf, pos)[0]
+            if id_size < 0:
+                raise ValueError(f"Invalid frame: negative ID length {id_size}")
+            pos += 4 + id_size
+    if end < pos + 4:
+        return None
+    pos += 4 + _UINT32.unpack_from(buf, pos)[0]
+    if end < pos:
+        return None
+    return pos - offset
+
+
+class FrameDecoder:
+    """
+    增量帧解码器
+    接收任意切分的字节块（socket读取、回放文件分段等），
+    依据帧内4字节长度字段切出完整帧，不完整的尾部留待下一次feed。
+    未缓存数据时，bytes输入中的完整帧以memoryview形式零拷贝返回。
+    """
+
+    def __init__(self, max_frame_size=16 * 1024 * 1024):
+        self.max_frame_size = max_frame_size
+        self.resyncs = 0
+        self.discarded_bytes = 0
+        self._buffer = bytearray()
+
+    @property
+    def pending(self) -> int:
+        """已缓存但尚未组成完整帧的字节数"""
+        return len(self._buffer)
+
+    def _split(self, view, copy):
+        frames = []
+        offset = 0
+        while True:
+            size = _frame_length(view, offset)
+            if size is None:
+                break
+            if size > self.max_frame_size:
+                raise ValueError(f"Frame too large: {size} bytes")
+            frame = view[offset:offset + size]
+            frames.append(bytes(frame) if copy else frame)
+            offset += size
+        return frames, offset
+
+    def feed(self, data) -> list:
+        """送入一段字节，返回其中已完整的帧列表"""
+        if not self._buffer:
+            view = memoryview(data)
+            frames, consumed = self._split(view, copy=not isinstance(data, bytes))
+            self._buffer += view[consumed:]
+            return frames
+        self._buffer += data
+        with memoryview(self._buffer) as view:
+            frames, consumed = self._split(view, copy=True)
+        del self._buffer[:consumed]
+        if len(self._buffer) > self.max_frame_size:
+            raise ValueError(f"Frame too large: more than {self.max_frame_size} bytes buffered")
+        return frames
+
+    def feed_message(self, data) -> list:
+        """
+        送入一条完整的WebSocket消息，消息边界同时也是帧边界
+        消息未被恰好切分完（长度字段有误）时丢弃残留字节并重置，记一次resync，
+        避免一个错误的长度字段让之后的所有帧都错位。
+        """
+        try:
+            frames = self.feed(data)
+        except (ValueError, struct.error):
+            frames = []
+            self.discarded_bytes += len(data)
+            self.resyncs += 1
+        if self._buffer:
+            self.discarded_bytes += len(self._buffer)
+            self.resyncs += 1
+            self._buffer.clear()
+        return frames
+
+    def close(self) -> None:
+        """结束输入，若仍有残缺帧则报错"""
+        if self._buffer:
+            pending = len(self._buffer)
+            self._buffer.clear()
+            raise ValueError(f"Truncated frame: {pending} trailing bytes")
+
+
+def decode_stream(stream, chunk_size=64 * 1024):
+    """从文件类对象分块读取并逐帧产出，用于录制回放和离线分析，不整体载入内存"""
+    decoder = FrameDecoder()
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield from decoder.feed(chunk)
+    decoder.close()
@@ -0,0 +1,38 @@
+"""
+JSON序列化层
+安装了orjson时使用orjson，否则回退到标准库json。
+dumps直接返回UTF-8 bytes，loads接受bytes/memoryview/str，省去中间的编解码。
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        """序列化为UTF-8编码的JSON bytes"""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """从bytes/memoryview/str反序列化JSON"""
+        return orjson.loads(data)
+else:
+    def dumps(obj) -> bytes:
+        """序列化为UTF-8编码的JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(data):
+        """从bytes/memoryview/str反序列化JSON"""
+        if not isinstance(data, str):
+            data = str(data, "utf-8")
+        return json.loads(data)
+
+
+def dumps_str(obj) -> str:
+    """序列化为JSON文本，用于WebSocket文本消息"""
+    return dumps(obj).decode("utf-8")
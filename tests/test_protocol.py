@@ -0,0 +1,78 @@
+"""
+FrameDecoder回归测试：长度字段异常的帧不能让解码器死循环或抛出未处理的异常
+local、web、webGoodluck三份protocol.py逐一测试
+"""
+import importlib.util
+import struct
+import threading
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_protocol(target):
+    spec = importlib.util.spec_from_file_location(f"protocol_{target}", ROOT_DIR / target / "protocol.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(params=["local", "web", "webGoodluck"])
+def protocol(request, monkeypatch):
+    monkeypatch.syspath_prepend(str(ROOT_DIR / request.param))
+    return load_protocol(request.param)
+
+
+def server_ack_prefix(protocol, event=352):
+    header = protocol.generate_header(message_type=protocol.SERVER_ACK,
+                                      serial_method=protocol.NO_SERIALIZATION,
+                                      compression_type=protocol.NO_COMPRESSION)
+    return bytes(header) + struct.pack(">I", event)
+
+
+def audio_frame(protocol, audio=b"\x00" * 8, session_id=b"session"):
+    return server_ack_prefix(protocol) + struct.pack(">I", len(session_id)) + session_id \
+        + struct.pack(">I", len(audio)) + audio
+
+
+def test_zero_size_frame_resyncs(protocol):
+    # ID长度为-16时按有符号数计算帧长为0，曾导致_split死循环
+    bad = server_ack_prefix(protocol) + struct.pack(">i", -16) + b"\x00" * 4
+    assert len(bad) == 16
+    decoder = protocol.FrameDecoder()
+    result = []
+    worker = threading.Thread(target=lambda: result.append(decoder.feed_message(bad)), daemon=True)
+    worker.start()
+    worker.join(timeout=5)
+    assert not worker.is_alive(), "FrameDecoder looped on a zero-size frame"
+    assert result == [[]]
+    assert decoder.resyncs == 1
+    assert decoder.pending == 0
+    frame = audio_frame(protocol)
+    assert [bytes(f) for f in decoder.feed_message(frame)] == [frame]
+
+
+def test_min_int_id_length_resyncs(protocol):
+    bad = server_ack_prefix(protocol) + struct.pack(">i", -2 ** 31) + b"\x00" * 4
+    decoder = protocol.FrameDecoder()
+    assert decoder.feed_message(bad) == []
+    assert decoder.resyncs == 1
+
+
+def test_zero_header_size_rejected(protocol):
+    decoder = protocol.FrameDecoder()
+    with pytest.raises(ValueError):
+        decoder.feed(b"\x10\xb0\x00\x00" + b"\x00" * 12)
+
+
+def test_stream_split_across_chunks(protocol):
+    frames = [audio_frame(protocol, bytes([i]) * (i + 1)) for i in range(5)]
+    stream = b"".join(frames)
+    decoder = protocol.FrameDecoder()
+    out = []
+    for offset in range(0, len(stream), 7):
+        out.extend(bytes(f) for f in decoder.feed(stream[offset:offset + 7]))
+    decoder.close()
+    assert out == frames
@@ -2,14 +2,15 @@ import os
 import sys
 import asyncio
 import json
+import time
 import base64
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse,  JSONResponse
+from fastapi.responses import HTMLResponse,  JSONResponse, PlainTextResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -22,7 +23,13 @@ load_dotenv(parent_dir / '.env')
 
 import config as app_config
 from audio_manager import DialogSession, AudioDeviceManager, AudioConfig
-from realtime_dialog_client import RealtimeDialogClient
+from realtime_dialog_client import RealtimeDialogClient, AudioCoalescer, EventDispatcher, traffic
+from protocol import ParsedFrame
+from connection_pool import UpstreamConnectionPool
+import latency
+import metrics
+from loop_monitor import LoopMonitor
+import serialization
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -64,17 +71,34 @@ class ConnectionManager:
         if session_id in self.session_manager:
             websocket = self.session_manager[session_id].websocket
             try:
-                await websocket.send_json(message)
+                text = serialization.dumps_str(message)
+                await websocket.send_text(text)
+                metrics.count_browser_out(len(text))
             except Exception as e:
                 logger.error(f"发送消息失败: {e}")
 
 manager = ConnectionManager()
+connection_pool = UpstreamConnectionPool(app_config.ws_connect_config, **app_config.connection_pool_config)
+loop_monitor = LoopMonitor(**app_config.loop_monitor_config)
+
+@app.on_event("startup")
+async def start_connection_pool():
+    """启动上游连接预热"""
+    await connection_pool.start()
+    loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_connection_pool():
+    """关闭预热的上游连接"""
+    await loop_monitor.stop()
+    await connection_pool.stop()
 
 class WebSession:
     def __init__(self, session_id: str, websocket: WebSocket):
         self.session_id = session_id
         self.websocket = websocket
         self.client = None
+        self.audio_coalescer = None
         self.is_connected = False
         self.is_dialog_active = False
         self.response_task = None
@@ -95,6 +119,16 @@ class WebSession:
         self.ai_final_response = ""        # 组合后的完整回复
         self.ai_response_timer = None      # 定时器，用于检测550事件结束
         
+        # 事件号 -> 处理函数
+        self.dispatcher = EventDispatcher()
+        self._register_handlers()
+        
+        # 轮次延迟时间线
+        self.latency = latency.LatencyTimeline(session_id, export_path=app_config.latency_config["export_path"],
+                                               log=logger.info)
+        if app_config.latency_config["enabled"]:
+            self.dispatcher.watch(latency.EVENT_POINTS, self.latency.on_event)
+        
     def reset_conversation_state(self):
         """重置对话状态，准备新一轮对话"""
         self.last_user_text = ""
@@ -121,16 +155,23 @@ class WebSession:
     async def initialize(self):
         """初始化会话 - 类似main.py的DialogSession"""
         try:
-            # 创建对话客户端
-            self.client = RealtimeDialogClient(
-                config=app_config.ws_connect_config,
-                session_id=self.session_id
+            started = time.monotonic()
+            # 从连接池取出已完成StartConnection的对话客户端
+            self.client = await connection_pool.acquire()
+            # 浏览器约每64ms发送一块音频，合并成更大的帧再上行
+            self.audio_coalescer = AudioCoalescer(
+                self.client.task_request,
+                sample_rate=app_config.input_audio_config["sample_rate"],
+                channels=app_config.input_audio_config["channels"],
+                **app_config.audio_coalesce_config
             )
             
-            # 建立连接
-            await self.client.connect()
+            # 开始会话
+            await self.client.start_session()
+            self.client.start_sender(**app_config.send_queue_config)
             await self.client.say_hello()
             self.is_connected = True
+            metrics.handshake_seconds.observe(time.monotonic() - started)
             logger.info(f"会话初始化成功: {self.session_id}")
             
         except Exception as e:
@@ -151,6 +192,13 @@ class WebSession:
         """停止对话模式"""
         self.is_dialog_active = False
         
+        # 发出合帧缓冲中剩余的音频
+        if self.audio_coalescer:
+            try:
+                await self.audio_coalescer.flush()
+            except Exception as e:
+                logger.error(f"发送剩余音频失败: {e}")
+        
         if self.response_task:
             self.response_task.cancel()
             try:
@@ -164,13 +212,9 @@ class WebSession:
     async def continuous_response_handler(self):
         """持续处理服务器响应 - 类似main.py的receive_loop"""
         try:
-            while self.is_dialog_active:
-                response = await self.client.receive_server_response()
+            async for response in self.client.events(events=self.dispatcher.subscribed()):
                 await self.handle_server_response(response)
-                
-                # 检查会话结束事件
-                if response.get('event') in [152, 153]:
-                    logger.info(f"会话结束: event={response.get('event')}")
+                if not self.is_dialog_active:
                     break
                     
         except asyncio.CancelledError:
@@ -183,17 +227,29 @@ class WebSession:
                 "text": f"响应处理异常: {e}"
             })
 
-    async def handle_server_response(self, response: Dict[str, Any]):
+    def _register_handlers(self):
+        """注册服务端事件处理函数 - 按事件号分发"""
+        self.dispatcher.on(352, self._on_tts_audio)
+        self.dispatcher.on(450, self._on_user_speech_start)
+        self.dispatcher.on(451, self._on_asr_response)
+        self.dispatcher.on(459, self._on_user_speech_end)
+        self.dispatcher.on(500, self._on_chat_interim)
+        self.dispatcher.on(550, self._on_chat_response)
+        self.dispatcher.on(152, self._on_session_finished)
+        self.dispatcher.on(153, self._on_session_finished)
+        self.dispatcher.on_error(self._on_server_error)
+        self.dispatcher.on_default(self._on_other_event)
+
+    async def handle_server_response(self, response: Optional[ParsedFrame]):
         """处理服务器响应 - 只显示最后一次的451和550，强化调试"""
-        if response == {}:
+        if not response:
             return
             
         # 详细日志记录
-        event = response.get('event')
-        message_type = response.get('message_type')
-        payload_msg = response.get('payload_msg', {})
+        event = response.event
+        message_type = response.message_type
         
-        logger.info(f"🔄 处理响应: message_type={message_type}, event={event}, payload_type={type(payload_msg)}")
+        logger.info(f"🔄 处理响应: message_type={message_type}, event={event}")
         
         # 发送调试信息到前端
         await manager.send_personal_message(self.session_id, {
@@ -203,158 +259,182 @@ class WebSession:
             "message_type": message_type
         })
         
-        # 音频响应 - 类似本地版本的音频处理
-        if response.get('message_type') == 'SERVER_ACK' and isinstance(response.get('payload_msg'), bytes):
-            audio_data = response['payload_msg']
-            logger.info(f"🔊 接收到音频数据: {len(audio_data)} 字节")
-            
-            # 发送音频数据到前端播放，使用base64编码
-            # 根据config.py中的output_audio_config配置
+        await self.dispatcher.dispatch(response)
+
+    async def _on_tts_audio(self, response: ParsedFrame):
+        """音频响应 - 类似本地版本的音频处理"""
+        audio_data = response.payload
+        if response.message_type != 'SERVER_ACK' or not isinstance(audio_data, (bytes, memoryview)):
+            await self._on_other_event(response)
+            return
+        logger.info(f"🔊 接收到音频数据: {len(audio_data)} 字节")
+        
+        # 发送音频数据到前端播放，使用base64编码
+        # 根据config.py中的output_audio_config配置
+        await manager.send_personal_message(self.session_id, {
+            "type": "audio_stream",
+            "audio": base64.b64encode(audio_data).decode('utf-8'),
+            "format": "pcm",
+            "sample_rate": 24000,  # 来自output_audio_config
+            "channels": 1,
+            "bit_depth": 32,  # pyaudio.paFloat32
+            "audio_format": "float32"
+        })
+        self.latency.mark("audio_forwarded")
+
+    async def _on_user_speech_start(self, response: ParsedFrame):
+        """Event 450: 检测到用户开始说话 - 重置对话状态"""
+        logger.info("🎤 检测到用户开始说话，重置对话状态")
+        self.reset_conversation_state()
+        await manager.send_personal_message(self.session_id, {
+            "type": "status_update",
+            "message": "正在识别语音..."
+        })
+
+    async def _on_asr_response(self, response: ParsedFrame):
+        """Event 451: ASR识别结果 - 缓存最新结果"""
+        payload_msg = response.get('payload_msg', {})
+        if not isinstance(payload_msg, dict) or "results" not in payload_msg:
+            await self._on_other_event(response)
+            return
+        results_list = payload_msg["results"]
+        if results_list and isinstance(results_list, list) and "text" in results_list[0]:
+            # 更新缓存的用户文本，但不立即发送气泡
+            self.last_user_text = results_list[0]["text"]
+            logger.info(f"💬 缓存用户语音: {self.last_user_text}")
+
+    async def _on_user_speech_end(self, response: ParsedFrame):
+        """Event 459: 用户说话结束 - 发送最终的用户消息气泡"""
+        logger.info("✋ 用户说话结束，发送最终用户消息")
+        if self.last_user_text and not self.user_message_sent:
             await manager.send_personal_message(self.session_id, {
-                "type": "audio_stream",
-                "audio": base64.b64encode(audio_data).decode('utf-8'),
-                "format": "pcm",
-                "sample_rate": 24000,  # 来自output_audio_config
-                "channels": 1,
-                "bit_depth": 32,  # pyaudio.paFloat32
-                "audio_format": "float32"
+                "type": "user_message",
+                "message": "我：",
+                "text": self.last_user_text
             })
+            self.user_message_sent = True
+            logger.info(f"✅ 已发送用户消息: {self.last_user_text}")
             
-        # 文本响应
-        elif response.get('message_type') == 'SERVER_FULL_RESPONSE':
-            
-            # Event 450: 检测到用户开始说话 - 重置对话状态
-            if event == 450:
-                logger.info("🎤 检测到用户开始说话，重置对话状态")
-                self.reset_conversation_state()
-                await manager.send_personal_message(self.session_id, {
-                    "type": "status_update",
-                    "message": "正在识别语音..."
-                })
-                
-            # Event 451: ASR识别结果 - 缓存最新结果
-            elif event == 451 and isinstance(payload_msg, dict) and "results" in payload_msg:
-                results_list = payload_msg["results"]
-                if results_list and isinstance(results_list, list) and "text" in results_list[0]:
-                    # 更新缓存的用户文本，但不立即发送气泡
-                    self.last_user_text = results_list[0]["text"]
-                    logger.info(f"💬 缓存用户语音: {self.last_user_text}")
-                    
-            # Event 459: 用户说话结束 - 发送最终的用户消息气泡
-            elif event == 459:
-                logger.info("✋ 用户说话结束，发送最终用户消息")
-                if self.last_user_text and not self.user_message_sent:
-                    await manager.send_personal_message(self.session_id, {
-                        "type": "user_message",
-                        "message": "我：",
-                        "text": self.last_user_text
-                    })
-                    self.user_message_sent = True
-                    logger.info(f"✅ 已发送用户消息: {self.last_user_text}")
-                    
-                await manager.send_personal_message(self.session_id, {
-                    "type": "status_update",
-                    "message": "语音识别完成，AI思考中..."
-                })
-                
-            # Event 500: AI中间回复 - 仅记录，绝不显示
-            elif event == 500 and "content" in payload_msg:
-                self.event_500_count += 1
-                # 仅更新缓存，绝对不发送任何消息气泡
-                self.last_ai_response = payload_msg["content"]
-                logger.info(f"🤖 AI中间回复(500-{self.event_500_count}): {payload_msg['content']} [仅缓存，绝不显示]")
-                # 只更新状态，不显示消息内容
-                await manager.send_personal_message(self.session_id, {
-                    "type": "status_update",
-                    "message": "AI正在思考中..."
-                })
-                
-            # Event 550: AI最终回复 - 收集所有550内容，组合成完整回复
-            elif event == 550 and "content" in payload_msg:
-                self.event_550_count += 1
-                content = payload_msg["content"]
-                
-                # 收集550事件的内容
-                self.ai_response_parts.append(content)
-                self.last_ai_response = content  # 保存最后一个550的内容
-                
-                logger.info(f"🎯 收到AI回复片段(550-{self.event_550_count}): {content}")
-                
-                # 组合所有550事件的内容成为完整回复
-                self.ai_final_response = "".join(self.ai_response_parts)
-                
-                # 如果还没有发送AI回复，立即发送当前组合的完整内容
-                if not self.ai_response_sent:
-                    await manager.send_personal_message(self.session_id, {
-                        "type": "assistant_message",
-                        "message": "豆包：",
-                        "text": self.ai_final_response
-                    })
-                    self.ai_response_sent = True
-                    logger.info(f"✅ 首次发送AI完整回复: {self.ai_final_response}")
-                else:
-                    # 如果已经发送过，更新现有的消息内容
-                    await manager.send_personal_message(self.session_id, {
-                        "type": "assistant_message_update",
-                        "message": "豆包：",
-                        "text": self.ai_final_response
-                    })
-                    logger.info(f"🔄 更新AI完整回复: {self.ai_final_response}")
-                
-                # 重置定时器，2秒后标记AI回复完成
-                if self.ai_response_timer:
-                    self.ai_response_timer.cancel()
-                
-                self.ai_response_timer = asyncio.create_task(self._ai_response_completion_timer())
-                
-                logger.info(f"📊 本轮550统计: {self.event_550_count}个片段, 完整回复长度: {len(self.ai_final_response)}字符")
-                
-                # 发送状态更新
-                await manager.send_personal_message(self.session_id, {
-                    "type": "status_update",
-                    "message": f"AI回复更新中... ({self.event_550_count}个片段)"
-                })
-                
-            # 其他事件 - 仅记录日志，绝不显示任何消息气泡
-            else:
-                logger.info(f"❓ 收到其他事件: event={event}, payload={payload_msg}")
-                
-                # 仅记录到日志，绝对不发送任何消息气泡，确保界面干净
-                if isinstance(payload_msg, dict) and "content" in payload_msg:
-                    content = payload_msg["content"]
-                    logger.info(f"📝 仅记录未处理的content事件{event}: {content} [不显示]")
-                    
-                    # 只发送调试信息到日志，不影响用户界面
-                    await manager.send_personal_message(self.session_id, {
-                        "type": "debug_info",
-                        "message": f"📝 记录事件{event}但未显示内容"
-                    })
-                
-                # 字符串类型的payload也只记录，不显示
-                elif isinstance(payload_msg, str) and payload_msg.strip():
-                    logger.info(f"📝 仅记录字符串响应事件{event}: {payload_msg} [不显示]")
-                    await manager.send_personal_message(self.session_id, {
-                        "type": "debug_info", 
-                        "message": f"📝 记录字符串事件{event}但未显示"
-                    })
-                
-        # 错误响应
-        elif response.get('message_type') == 'SERVER_ERROR_RESPONSE':
-            error_detail = str(response.get('payload_msg', '未知错误'))
-            logger.error(f"❌ 服务器错误: {error_detail}")
+        await manager.send_personal_message(self.session_id, {
+            "type": "status_update",
+            "message": "语音识别完成，AI思考中..."
+        })
+
+    async def _on_chat_interim(self, response: ParsedFrame):
+        """Event 500: AI中间回复 - 仅记录，绝不显示"""
+        payload_msg = response.get('payload_msg', {})
+        if "content" not in payload_msg:
+            await self._on_other_event(response)
+            return
+        self.event_500_count += 1
+        # 仅更新缓存，绝对不发送任何消息气泡
+        self.last_ai_response = payload_msg["content"]
+        logger.info(f"🤖 AI中间回复(500-{self.event_500_count}): {payload_msg['content']} [仅缓存，绝不显示]")
+        # 只更新状态，不显示消息内容
+        await manager.send_personal_message(self.session_id, {
+            "type": "status_update",
+            "message": "AI正在思考中..."
+        })
+
+    async def _on_chat_response(self, response: ParsedFrame):
+        """Event 550: AI最终回复 - 收集所有550内容，组合成完整回复"""
+        payload_msg = response.get('payload_msg', {})
+        if "content" not in payload_msg:
+            await self._on_other_event(response)
+            return
+        self.event_550_count += 1
+        content = payload_msg["content"]
+        
+        # 收集550事件的内容
+        self.ai_response_parts.append(content)
+        self.last_ai_response = content  # 保存最后一个550的内容
+        
+        logger.info(f"🎯 收到AI回复片段(550-{self.event_550_count}): {content}")
+        
+        # 组合所有550事件的内容成为完整回复
+        self.ai_final_response = "".join(self.ai_response_parts)
+        
+        # 如果还没有发送AI回复，立即发送当前组合的完整内容
+        if not self.ai_response_sent:
             await manager.send_personal_message(self.session_id, {
-                "type": "error",
-                "message": "错误",
-                "text": f"服务器错误: {error_detail}"
+                "type": "assistant_message",
+                "message": "豆包：",
+                "text": self.ai_final_response
             })
+            self.ai_response_sent = True
+            self.latency.mark("text_forwarded")
+            logger.info(f"✅ 首次发送AI完整回复: {self.ai_final_response}")
+        else:
+            # 如果已经发送过，更新现有的消息内容
+            await manager.send_personal_message(self.session_id, {
+                "type": "assistant_message_update",
+                "message": "豆包：",
+                "text": self.ai_final_response
+            })
+            logger.info(f"🔄 更新AI完整回复: {self.ai_final_response}")
+        
+        # 重置定时器，2秒后标记AI回复完成
+        if self.ai_response_timer:
+            self.ai_response_timer.cancel()
+        
+        self.ai_response_timer = asyncio.create_task(self._ai_response_completion_timer())
+        
+        logger.info(f"📊 本轮550统计: {self.event_550_count}个片段, 完整回复长度: {len(self.ai_final_response)}字符")
+        
+        # 发送状态更新
+        await manager.send_personal_message(self.session_id, {
+            "type": "status_update",
+            "message": f"AI回复更新中... ({self.event_550_count}个片段)"
+        })
+
+    async def _on_session_finished(self, response: ParsedFrame):
+        """检查会话结束事件"""
+        logger.info(f"会话结束: event={response.event}")
+
+    async def _on_server_error(self, response: ParsedFrame):
+        """错误响应"""
+        error_detail = str(response.get('payload_msg', '未知错误'))
+        logger.error(f"❌ 服务器错误: {error_detail}")
+        await manager.send_personal_message(self.session_id, {
+            "type": "error",
+            "message": "错误",
+            "text": f"服务器错误: {error_detail}"
+        })
+
+    async def _on_other_event(self, response: ParsedFrame):
+        """其他事件 - 仅记录日志，绝不显示任何消息气泡"""
+        event = response.event
         
         # 兜底：记录所有未处理的响应
-        else:
+        if response.message_type != 'SERVER_FULL_RESPONSE':
             logger.warning(f"🔍 未处理的响应类型: {response}")
             await manager.send_personal_message(self.session_id, {
                 "type": "debug_info",
                 "message": f"🔍 未处理响应: {response}"
             })
+            return
+        
+        payload_msg = response.get('payload_msg', {})
+        logger.info(f"❓ 收到其他事件: event={event}, payload={payload_msg}")
+        
+        # 仅记录到日志，绝对不发送任何消息气泡，确保界面干净
+        if isinstance(payload_msg, dict) and "content" in payload_msg:
+            content = payload_msg["content"]
+            logger.info(f"📝 仅记录未处理的content事件{event}: {content} [不显示]")
+            
+            # 只发送调试信息到日志，不影响用户界面
+            await manager.send_personal_message(self.session_id, {
+                "type": "debug_info",
+                "message": f"📝 记录事件{event}但未显示内容"
+            })
+        
+        # 字符串类型的payload也只记录，不显示
+        elif isinstance(payload_msg, str) and payload_msg.strip():
+            logger.info(f"📝 仅记录字符串响应事件{event}: {payload_msg} [不显示]")
+            await manager.send_personal_message(self.session_id, {
+                "type": "debug_info", 
+                "message": f"📝 记录字符串事件{event}但未显示"
+            })
 
     async def send_audio_chunk(self, audio_data: bytes):
         """发送音频块 - 流式发送"""
@@ -362,12 +442,14 @@ class WebSession:
             return
             
         try:
-            await self.client.task_request(audio_data)
+            await self.audio_coalescer.push(audio_data)
         except Exception as e:
             logger.error(f"发送音频失败: {e}")
 
     def cleanup(self):
         """清理资源"""
+        if self.audio_coalescer:
+            self.audio_coalescer.discard()
         asyncio.create_task(self.stop_dialog_mode())
         if self.client:
             asyncio.create_task(self.client.close())
@@ -460,7 +542,9 @@ async def websocket_endpoint(websocket: WebSocket):
         
         # 主消息循环
         while True:
-            data = await websocket.receive_json()
+            text = await websocket.receive_text()
+            metrics.count_browser_in(len(text))
+            data = serialization.loads(text)
             
             if data["type"] == "start_dialog":
                 # 开启对话模式
@@ -507,6 +591,66 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.error(f"WebSocket错误: {e}")
         manager.disconnect(session_id)
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus指标"""
+    sessions = list(manager.session_manager.values())
+    clients = [session.client for session in sessions if session.client is not None]
+    senders = [client.sender for client in clients if client.sender is not None]
+    out = metrics.Exposition()
+    out.metric("doubao_active_sessions", "gauge", "Browser sessions in the session manager.",
+               [(None, len(sessions))])
+    out.metric("doubao_dialog_sessions", "gauge", "Browser sessions with dialog mode on.",
+               [(None, sum(1 for session in sessions if session.is_dialog_active))])
+    out.metric("doubao_upstream_connections", "gauge", "Upstream WebSocket connections.",
+               [({"state": "idle"}, connection_pool.idle_count),
+                ({"state": "in_use"}, sum(1 for client in clients if client.connection is None and client.is_open())),
+                ({"state": "multiplexed"}, connection_pool.connection_count)])
+    out.metric("doubao_upstream_pool_requests_total", "counter", "Connection pool acquisitions.",
+               [({"result": "hit"}, connection_pool.hits), ({"result": "miss"}, connection_pool.misses)])
+    out.metric("doubao_upstream_reconnects_total", "counter", "Transparent upstream reconnects.",
+               [(None, traffic.reconnects)])
+    out.metric("doubao_frames_total", "counter", "Frames/messages sent and received.",
+               [({"peer": "upstream", "direction": "in"}, traffic.frames_in),
+                ({"peer": "upstream", "direction": "out"}, traffic.frames_out),
+                ({"peer": "browser", "direction": "in"}, metrics.browser_messages_in),
+                ({"peer": "browser", "direction": "out"}, metrics.browser_messages_out)])
+    out.metric("doubao_bytes_total", "counter", "Bytes sent and received on the wire.",
+               [({"peer": "upstream", "direction": "in"}, traffic.bytes_in),
+                ({"peer": "upstream", "direction": "out"}, traffic.bytes_out),
+                ({"peer": "browser", "direction": "in"}, metrics.browser_bytes_in),
+                ({"peer": "browser", "direction": "out"}, metrics.browser_bytes_out)])
+    out.metric("doubao_upstream_payload_bytes_total", "counter", "Upstream payload bytes before and after compression.",
+               [({"stage": "raw"}, traffic.raw_payload_bytes),
+                ({"stage": "compressed"}, traffic.compressed_payload_bytes)])
+    out.metric("doubao_send_queue_depth", "gauge", "Frames waiting in upstream send queues.",
+               [({"stat": "sum"}, sum(sender.depth for sender in senders)),
+                ({"stat": "max"}, max((sender.depth for sender in senders), default=0))])
+    out.metric("doubao_send_queue_dropped_audio_frames_total", "counter", "Audio frames dropped by send queues.",
+               [(None, traffic.dropped_audio_frames)])
+    out.metric("doubao_event_loop_lag_seconds", "gauge", "Event loop wake-up delay over the recent window.",
+               [({"stat": "last"}, loop_monitor.last), ({"stat": "max"}, loop_monitor.max)] +
+               [({"stat": f"p{q}"}, loop_monitor.percentile(q) or 0.0) for q in (50, 90, 99)])
+    out.histogram("doubao_event_loop_lag_distribution_seconds", "Event loop wake-up delay distribution.",
+                  [(None, loop_monitor.histogram)])
+    out.metric("doubao_event_loop_slow_callbacks_total", "counter", "Times the loop was blocked past the threshold.",
+               [(None, loop_monitor.slow_callbacks)])
+    out.histogram("doubao_handshake_seconds", "Session initialization time (acquire + StartSession).",
+                  [(None, metrics.handshake_seconds)])
+    out.histogram("doubao_turn_stage_seconds", "Per-turn stage latency.",
+                  [({"stage": name}, histogram) for name, histogram in latency.histograms.items()])
+    return out.render()
+
+@app.get("/debug/loop")
+async def loop_debug():
+    """最近的事件循环阻塞记录（含阻塞时的调用栈）"""
+    return {
+        "lag_ms": {f"p{q}": (loop_monitor.percentile(q) or 0.0) * 1000 for q in (50, 90, 99)},
+        "max_lag_ms": loop_monitor.max * 1000,
+        "slow_callbacks": loop_monitor.slow_callbacks,
+        "snapshots": loop_monitor.recent_snapshots(),
+    }
+
 @app.get("/.well-known/appspecific/com.chrome.devtools.json")
 async def chrome_devtools():
     """处理Chrome DevTools请求，避免404错误"""
@@ -1,16 +1,16 @@
 import asyncio
 import uuid
-import queue
-import threading
 import time
 from typing import Optional, Dict, Any
-import wave
 import pyaudio
 import signal
 from dataclasses import dataclass
 
 import config
-from realtime_dialog_client import RealtimeDialogClient
+import latency
+import protocol
+from recorder import StreamingRecorder
+from realtime_dialog_client import RealtimeDialogClient, EventDispatcher
 
 
 @dataclass
@@ -33,26 +33,28 @@ class AudioDeviceManager:
         self.input_stream: Optional[pyaudio.Stream] = None
         self.output_stream: Optional[pyaudio.Stream] = None
 
-    def open_input_stream(self) -> pyaudio.Stream:
-        """打开音频输入流"""
+    def open_input_stream(self, stream_callback=None) -> pyaudio.Stream:
+        """打开音频输入流；传入stream_callback时以回调模式采集"""
         # p = pyaudio.PyAudio()
         self.input_stream = self.pyaudio.open(
             format=self.input_config.bit_size,
             channels=self.input_config.channels,
             rate=self.input_config.sample_rate,
             input=True,
-            frames_per_buffer=self.input_config.chunk
+            frames_per_buffer=self.input_config.chunk,
+            stream_callback=stream_callback
         )
         return self.input_stream
 
-    def open_output_stream(self) -> pyaudio.Stream:
-        """打开音频输出流"""
+    def open_output_stream(self, stream_callback=None, frames_per_buffer: Optional[int] = None) -> pyaudio.Stream:
+        """打开音频输出流；传入stream_callback时以回调模式播放"""
         self.output_stream = self.pyaudio.open(
             format=self.output_config.bit_size,
             channels=self.output_config.channels,
             rate=self.output_config.sample_rate,
             output=True,
-            frames_per_buffer=self.output_config.chunk
+            frames_per_buffer=frames_per_buffer or self.output_config.chunk,
+            stream_callback=stream_callback
         )
         return self.output_stream
 
@@ -65,6 +67,255 @@ class AudioDeviceManager:
         self.pyaudio.terminate()
 
 
+class MicrophoneCapture:
+    """
+    麦克风采集
+    PyAudio回调模式在音频线程中取得每个chunk，经call_soon_threadsafe放入asyncio队列，
+    事件循环不再阻塞在stream.read上。队列满时丢弃最旧的chunk。
+    """
+
+    def __init__(self, audio_device: AudioDeviceManager, loop: asyncio.AbstractEventLoop, max_chunks: int = 50):
+        self.audio_device = audio_device
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+        self.stream: Optional[pyaudio.Stream] = None
+        self.overflows = 0
+        self.dropped_chunks = 0
+
+    def start(self) -> None:
+        self.stream = self.audio_device.open_input_stream(stream_callback=self._callback)
+        self.stream.start_stream()
+
+    def stop(self) -> None:
+        if self.stream and self.stream.is_active():
+            self.stream.stop_stream()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """运行在PyAudio音频线程中，只做入队，不做其他处理"""
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+        self.loop.call_soon_threadsafe(self._enqueue, in_data)
+        return None, pyaudio.paContinue
+
+    def _enqueue(self, data: bytes) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped_chunks += 1
+        self.queue.put_nowait(data)
+
+    async def read(self, timeout: Optional[float] = None) -> Optional[bytes]:
+        """取下一个chunk，超时返回None"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class AudioRingBuffer:
+    """
+    单生产者单消费者环形缓冲
+    生产者（事件循环）只推进write_pos，消费者（音频回调线程）只推进read_pos，
+    两个位置都只增不减，依赖GIL下整数赋值的原子性，无需加锁。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.write_pos = 0
+        self.read_pos = 0
+
+    @property
+    def available(self) -> int:
+        return self.write_pos - self.read_pos
+
+    def write(self, data) -> int:
+        """写入尽可能多的数据，返回写入的字节数（生产者调用）"""
+        size = min(len(data), self.capacity - self.available)
+        if size <= 0:
+            return 0
+        start = self.write_pos % self.capacity
+        first = min(size, self.capacity - start)
+        self.view[start:start + first] = data[:first]
+        if size > first:
+            self.view[:size - first] = data[first:size]
+        self.write_pos += size
+        return size
+
+    def read_into(self, out: memoryview, size: int) -> int:
+        """读取最多size字节到out，返回读取的字节数（消费者调用）"""
+        size = min(size, self.available)
+        if size <= 0:
+            return 0
+        start = self.read_pos % self.capacity
+        first = min(size, self.capacity - start)
+        out[:first] = self.view[start:start + first]
+        if size > first:
+            out[first:size] = self.view[:size - first]
+        self.read_pos += size
+        return size
+
+    def skip_to(self, position: int) -> int:
+        """丢弃position之前的数据，返回丢弃的字节数（消费者调用）"""
+        position = min(position, self.write_pos)
+        skipped = max(0, position - self.read_pos)
+        self.read_pos += skipped
+        return skipped
+
+
+class PlaybackEngine:
+    """
+    回调驱动的TTS播放引擎
+    事件循环把收到的音频写入环形缓冲，PyAudio回调每period_ms取一次数据送往声卡。
+    抖动缓冲：缓冲达到prefill_ms才开始播放；播放中缓冲耗尽记一次underrun并输出静音，
+    重新缓冲到low_watermark_ms后恢复；缓冲超过high_watermark_ms时丢弃最旧的音频以限制延迟；
+    环形缓冲写满时丢弃新到的音频记为overrun。一段回复结束（end_of_stream）后不足prefill也照常播完。
+    打断（interrupt）一次性丢弃环形缓冲中未播放的音频；abort_on_interrupt时同时中止输出流，
+    丢弃声卡中已缓冲的音频，并统计打断延迟。
+    """
+
+    def __init__(self, audio_device: AudioDeviceManager, prefill_ms: int = 120, low_watermark_ms: int = 60,
+                 high_watermark_ms: int = 30000, period_ms: int = 20, capacity_ms: int = 60000,
+                 abort_on_interrupt: bool = True):
+        output_config = audio_device.output_config
+        sample_width = 4 if output_config.bit_size == pyaudio.paFloat32 else 2
+        self.bytes_per_ms = output_config.sample_rate * output_config.channels * sample_width // 1000
+        self.frame_bytes = output_config.channels * sample_width
+        self.audio_device = audio_device
+        self.period_frames = output_config.sample_rate * period_ms // 1000
+        self.prefill = prefill_ms * self.bytes_per_ms
+        self.low_watermark = low_watermark_ms * self.bytes_per_ms
+        self.high_watermark = high_watermark_ms * self.bytes_per_ms
+        self.ring = AudioRingBuffer(capacity_ms * self.bytes_per_ms)
+        self.abort_on_interrupt = abort_on_interrupt
+        self.stream: Optional[pyaudio.Stream] = None
+        self.playing = False
+        self.draining = False
+        self.resume_level = self.prefill
+        # 计数器：只由单一线程写入
+        self.underruns = 0
+        self.overrun_bytes = 0
+        self.trimmed_bytes = 0
+        self.played_bytes = 0
+        self.max_level = 0
+        self.interrupts = 0
+        self.last_interrupt_ms = 0.0
+        self.interrupt_latency = latency.Histogram(buckets_ms=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+        self._flush_to = 0
+        self._interrupt_at: Optional[float] = None
+        self._out = bytearray(self.period_frames * self.frame_bytes)
+
+    @property
+    def buffered_ms(self) -> float:
+        return self.ring.available / self.bytes_per_ms
+
+    def start(self) -> None:
+        self.stream = self.audio_device.open_output_stream(stream_callback=self._callback,
+                                                           frames_per_buffer=self.period_frames)
+        self.stream.start_stream()
+
+    def stop(self) -> None:
+        if self.stream and self.stream.is_active():
+            self.stream.stop_stream()
+
+    def write(self, data) -> None:
+        """写入一段TTS音频（事件循环调用）"""
+        written = self.ring.write(data)
+        if written < len(data):
+            self.overrun_bytes += len(data) - written
+        self.draining = False
+        level = self.ring.available
+        if level > self.max_level:
+            self.max_level = level
+
+    def end_of_stream(self) -> None:
+        """本段回复已收完，剩余音频不再等待prefill"""
+        self.draining = True
+
+    def interrupt(self) -> float:
+        """
+        打断播放（事件循环调用），返回丢弃的未播放音频时长（毫秒）
+        打断延迟从调用时算起：中止输出流时到中止完成为止；
+        否则到回调下一次输出静音、声卡中剩余的音频播完为止。
+        """
+        started = time.monotonic()
+        discarded = self.ring.available
+        active = self.playing or discarded > 0
+        self._flush_to = self.ring.write_pos
+        self.draining = False
+        if not active:
+            return 0.0
+        if self.abort_on_interrupt and self.stream is not None and self.stream.is_active():
+            # 中止后回调线程已停止，可以在当前线程直接丢弃缓冲
+            self.stream.abort_stream()
+            self._discard()
+            self._record_interrupt(time.monotonic() - started)
+            self.stream.start_stream()
+        else:
+            self._interrupt_at = started
+        return discarded / self.bytes_per_ms
+
+    def _discard(self) -> None:
+        self.ring.skip_to(self._flush_to)
+        self.playing = False
+        self.resume_level = self.prefill
+
+    def _record_interrupt(self, seconds: float) -> None:
+        self.interrupts += 1
+        self.last_interrupt_ms = seconds * 1000
+        self.interrupt_latency.observe(seconds)
+
+    @staticmethod
+    def _output_delay(time_info) -> float:
+        """本次回调的数据距离实际从声卡播出还有多久（秒）"""
+        if not time_info:
+            return 0.0
+        delay = time_info.get("output_buffer_dac_time", 0) - time_info.get("current_time", 0)
+        return delay if 0 < delay < 1 else 0.0
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """运行在PyAudio音频线程中"""
+        ring = self.ring
+        interrupted_at = self._interrupt_at
+        if interrupted_at is not None or self._flush_to > ring.read_pos:
+            self._discard()
+            if interrupted_at is not None:
+                self._interrupt_at = None
+                self._record_interrupt(time.monotonic() - interrupted_at + self._output_delay(time_info))
+        wanted = frame_count * self.frame_bytes
+        if len(self._out) != wanted:
+            self._out = bytearray(wanted)
+        out = memoryview(self._out)
+        level = ring.available
+        if level > self.high_watermark:
+            self.trimmed_bytes += ring.skip_to(ring.write_pos - self.high_watermark)
+            level = ring.available
+        if not self.playing:
+            if level >= self.resume_level or (self.draining and level > 0):
+                self.playing = True
+            else:
+                return bytes(wanted), pyaudio.paContinue
+        read = ring.read_into(out, wanted)
+        self.played_bytes += read
+        if read < wanted:
+            out[read:] = bytes(wanted - read)
+            self.playing = False
+            if not self.draining:
+                # 回复中途缓冲耗尽
+                self.underruns += 1
+                self.resume_level = self.low_watermark
+            else:
+                self.resume_level = self.prefill
+        return bytes(self._out), pyaudio.paContinue
+
+    def stats(self) -> str:
+        return (f"underruns={self.underruns}, overrun={self.overrun_bytes / self.bytes_per_ms:.0f}ms, "
+                f"trimmed={self.trimmed_bytes / self.bytes_per_ms:.0f}ms, "
+                f"max_buffered={self.max_level / self.bytes_per_ms:.0f}ms, interrupts={self.interrupts}"
+                + (f" (p50={self.interrupt_latency.percentile(50) * 1000:.0f}ms, "
+                   f"p99={self.interrupt_latency.percentile(99) * 1000:.0f}ms)" if self.interrupts else ""))
+
+
 class DialogSession:
     """对话会话管理类"""
 
@@ -81,74 +332,78 @@ class DialogSession:
         self.is_session_finished = False
         self.is_user_querying = False
         self.is_sending_chat_tts_text = False
-        self.audio_buffer = b''
+        self.output_recorder = create_recorder(self.audio_device.output_config, config.output_recording_config)
+        self.dispatcher = EventDispatcher()
+        self._register_handlers()
+        self.latency = latency.LatencyTimeline(self.session_id, export_path=config.latency_config["export_path"])
+        if config.latency_config["enabled"]:
+            self.dispatcher.watch(latency.EVENT_POINTS, self.latency.on_event)
 
         signal.signal(signal.SIGINT, self._keyboard_signal)
-        # 初始化音频队列和输出流
-        self.audio_queue = queue.Queue()
-        self.output_stream = self.audio_device.open_output_stream()
-        # 启动播放线程
+        # 回调驱动的播放引擎
+        self.player = PlaybackEngine(self.audio_device, **config.playback_config)
+        self.player.start()
         self.is_recording = True
-        self.is_playing = True
-        self.player_thread = threading.Thread(target=self._audio_player_thread)
-        self.player_thread.daemon = True
-        self.player_thread.start()
-
-    def _audio_player_thread(self):
-        """音频播放线程"""
-        while self.is_playing:
-            try:
-                # 从队列获取音频数据
-                audio_data = self.audio_queue.get(timeout=1.0)
-                if audio_data is not None:
-                    self.output_stream.write(audio_data)
-            except queue.Empty:
-                # 队列为空时等待一小段时间
-                time.sleep(0.1)
-            except Exception as e:
-                print(f"音频播放错误: {e}")
-                time.sleep(0.1)
 
-    def handle_server_response(self, response: Dict[str, Any]) -> None:
-        if response == {}:
-            return
-        """处理服务器响应"""
-        if response['message_type'] == 'SERVER_ACK' and isinstance(response.get('payload_msg'), bytes):
-            # print(f"\n接收到音频数据: {len(response['payload_msg'])} 字节")
-            if self.is_sending_chat_tts_text:
-                return
-            audio_data = response['payload_msg']
-            self.audio_queue.put(audio_data)
-            self.audio_buffer += audio_data
-        elif response['message_type'] == 'SERVER_FULL_RESPONSE':
+    def _register_handlers(self) -> None:
+        """注册服务端事件处理函数"""
+        self.dispatcher.on(352, self._on_tts_audio)
+        self.dispatcher.on(450, self._on_user_speech_start)
+        self.dispatcher.on(350, self._on_tts_sentence_start)
+        self.dispatcher.on(459, self._on_user_speech_end)
+        self.dispatcher.on(359, self._on_tts_ended)
+        self.dispatcher.on(152, self._on_session_finished)
+        self.dispatcher.on(153, self._on_session_finished)
+        self.dispatcher.on_error(self._on_server_error)
+        self.dispatcher.on_default(self._print_response)
+
+    def _print_response(self, response: protocol.ParsedFrame) -> None:
+        if response.message_type == 'SERVER_FULL_RESPONSE':
             print(f"服务器响应: {response}")
-            event = response.get('event')
-            payload_msg = response.get('payload_msg', {})
-
-            if event == 450:
-                print(f"清空缓存音频: {response['session_id']}")
-                while not self.audio_queue.empty():
-                    try:
-                        self.audio_queue.get_nowait()
-                    except queue.Empty:
-                        continue
-                self.is_user_querying = True
-
-            if event == 350 and self.is_sending_chat_tts_text and payload_msg.get("tts_type") == "chat_tts_text":
-                while not self.audio_queue.empty():
-                    try:
-                        self.audio_queue.get_nowait()
-                    except queue.Empty:
-                        continue
-                self.is_sending_chat_tts_text = False
-
-            if event == 459:
-                self.is_user_querying = False
-                # 禁用随机触发测试消息，让系统自然响应
-                pass
-        elif response['message_type'] == 'SERVER_ERROR':
-            print(f"服务器错误: {response['payload_msg']}")
-            raise Exception("服务器错误")
+
+    def _on_tts_audio(self, response: protocol.ParsedFrame) -> None:
+        """TTS音频（SERVER_ACK）"""
+        if not isinstance(response.payload, (bytes, memoryview)):
+            self._print_response(response)
+            return
+        # print(f"\n接收到音频数据: {len(response['payload_msg'])} 字节")
+        if self.is_sending_chat_tts_text:
+            return
+        audio_data = response.payload
+        self.player.write(audio_data)
+        if self.output_recorder:
+            self.output_recorder.write(audio_data)
+
+    def _on_user_speech_start(self, response: protocol.ParsedFrame) -> None:
+        self._print_response(response)
+        discarded = self.player.interrupt()
+        print(f"清空缓存音频: {response.session_id}, 丢弃 {discarded:.0f}ms")
+        self.is_user_querying = True
+
+    def _on_tts_sentence_start(self, response: protocol.ParsedFrame) -> None:
+        self._print_response(response)
+        payload_msg = response.get('payload_msg', {})
+        if self.is_sending_chat_tts_text and payload_msg.get("tts_type") == "chat_tts_text":
+            self.player.interrupt()
+            self.is_sending_chat_tts_text = False
+
+    def _on_user_speech_end(self, response: protocol.ParsedFrame) -> None:
+        self._print_response(response)
+        self.is_user_querying = False
+        # 禁用随机触发测试消息，让系统自然响应
+
+    def _on_tts_ended(self, response: protocol.ParsedFrame) -> None:
+        self._print_response(response)
+        self.player.end_of_stream()
+
+    def _on_session_finished(self, response: protocol.ParsedFrame) -> None:
+        self._print_response(response)
+        print(f"receive session finished event: {response.event}")
+        self.is_session_finished = True
+
+    def _on_server_error(self, response: protocol.ParsedFrame) -> None:
+        # 只记录，不中断接收循环，否则之后的响应（包括SessionFinished）都不会再被处理
+        print(f"服务器错误: code={response.code}, {response.payload}")
 
     async def trigger_chat_tts_text(self):
         """触发发送ChatTTSText请求 - 用于系统主动响应"""
@@ -159,44 +414,49 @@ class DialogSession:
     def _keyboard_signal(self, sig, frame):
         print(f"receive keyboard Ctrl+C")
         self.is_recording = False
-        self.is_playing = False
         self.is_running = False
 
     async def receive_loop(self):
         try:
-            while True:
-                response = await self.client.receive_server_response()
-                self.handle_server_response(response)
-                if 'event' in response and (response['event'] == 152 or response['event'] == 153):
-                    print(f"receive session finished event: {response['event']}")
-                    self.is_session_finished = True
-                    break
+            await self.dispatcher.run(self.client)
         except asyncio.CancelledError:
             print("接收任务已取消")
         except Exception as e:
             print(f"接收消息错误: {e}")
+        finally:
+            # 接收循环已退出，不会再收到SessionFinished，避免start()在退出时一直等待
+            self.is_session_finished = True
 
     async def process_microphone_input(self) -> None:
         await self.client.say_hello()
         """处理麦克风输入"""
-        stream = self.audio_device.open_input_stream()
+        capture = MicrophoneCapture(self.audio_device, asyncio.get_running_loop())
+        input_recorder = create_recorder(self.audio_device.input_config, config.input_recording_config)
+        capture.start()
         print("已打开麦克风，请讲话...")
 
         while self.is_recording:
             try:
-                # 添加exception_on_overflow=False参数来忽略溢出错误
-                audio_data = stream.read(config.input_audio_config["chunk"], exception_on_overflow=False)
-                save_pcm_to_wav(audio_data, "input.pcm")
+                # 定时醒来检查is_recording
+                audio_data = await capture.read(timeout=0.5)
+                if audio_data is None:
+                    continue
+                if input_recorder:
+                    input_recorder.write(audio_data)
                 await self.client.task_request(audio_data)
-                await asyncio.sleep(0.01)  # 避免CPU过度使用
             except Exception as e:
                 print(f"读取麦克风数据出错: {e}")
                 await asyncio.sleep(0.1)  # 给系统一些恢复时间
+        capture.stop()
+        close_recorder(input_recorder)
+        if capture.overflows or capture.dropped_chunks:
+            print(f"麦克风输入溢出 {capture.overflows} 次，丢弃 {capture.dropped_chunks} 个音频块")
 
     async def start(self) -> None:
         """启动对话会话"""
         try:
             await self.client.connect()
+            self.client.start_sender(**config.send_queue_config)
             asyncio.create_task(self.process_microphone_input())
             asyncio.create_task(self.receive_loop())
 
@@ -210,29 +470,44 @@ class DialogSession:
             await asyncio.sleep(0.1)
             await self.client.close()
             print(f"dialog request logid: {self.client.logid}")
-            save_audio_to_pcm_file(self.audio_buffer, "output.pcm")
+            self.player.stop()
+            print(f"播放统计: {self.player.stats()}")
+            if self.latency.completed:
+                print(latency.format_histograms())
         except Exception as e:
             print(f"会话错误: {e}")
         finally:
             self.audio_device.cleanup()
+            close_recorder(self.output_recorder)
 
 
-def save_pcm_to_wav(pcm_data: bytes, filename: str) -> None:
-    """保存PCM数据为WAV文件"""
-    with wave.open(filename, 'wb') as wf:
-        wf.setnchannels(config.input_audio_config["channels"])
-        wf.setsampwidth(2)  # paInt16 = 2 bytes
-        wf.setframerate(config.input_audio_config["sample_rate"])
-        wf.writeframes(pcm_data)
+def create_recorder(audio_config: AudioConfig, recording: Dict[str, Any]) -> Optional[StreamingRecorder]:
+    """按录音配置创建并启动录音器，未启用时返回None"""
+    if not recording["enabled"]:
+        return None
+    float_samples = audio_config.bit_size == pyaudio.paFloat32
+    recorder = StreamingRecorder(
+        recording["path"],
+        audio_config.sample_rate,
+        audio_config.channels,
+        sample_width=4 if float_samples else 2,
+        float_samples=float_samples,
+        max_bytes=recording["max_bytes"],
+        max_seconds=recording["max_seconds"]
+    )
+    recorder.start()
+    return recorder
 
 
-def save_audio_to_pcm_file(audio_data: bytes, filename: str) -> None:
-    """保存原始PCM音频数据到文件"""
-    if not audio_data:
+def close_recorder(recorder: Optional[StreamingRecorder]) -> None:
+    """写完剩余音频并输出录音结果"""
+    if recorder is None:
+        return
+    recorder.close()
+    if not recorder.files:
         print("No audio data to save.")
         return
-    try:
-        with open(filename, 'wb') as f:
-            f.write(audio_data)
-    except IOError as e:
-        print(f"Failed to save pcm file: {e}")
+    files = recorder.files[0] if len(recorder.files) == 1 else f"{recorder.files[0]} ~ {recorder.files[-1]}"
+    print(f"录音已保存: {files} ({recorder.written_bytes} 字节)")
+    if recorder.dropped_bytes:
+        print(f"录音丢弃 {recorder.dropped_bytes} 字节")
@@ -19,7 +19,8 @@ if not X_API_APP_ID or not X_API_ACCESS_KEY:
 
 # 配置信息
 ws_connect_config = {
-    "base_url": "wss://openspeech.bytedance.com/api/v3/realtime/dialogue",
+    # 可通过DOUBAO_BASE_URL指向本地模拟服务端（benchmarks/mock_server.py）
+    "base_url": os.getenv("DOUBAO_BASE_URL", "wss://openspeech.bytedance.com/api/v3/realtime/dialogue"),
     "headers": {
         "X-Api-App-ID": X_API_APP_ID,
         "X-Api-Access-Key": X_API_ACCESS_KEY,
@@ -63,3 +64,96 @@ output_audio_config = {
     "sample_rate": 24000,
     "bit_size": pyaudio.paFloat32
 }
+
+# 各类上行消息的压缩策略
+# method: "none" | "gzip" | "zlib"；adaptive为True时压缩收益过低会自动关闭
+compression_config = {
+    "audio": {"method": "none"},    # TaskRequest：PCM几乎不可压缩
+    "control": {"method": "gzip", "level": 6},    # StartConnection/StartSession/FinishSession/FinishConnection
+    "text": {"method": "gzip", "level": 6},    # SayHello/ChatTTSText
+}
+
+# 上行音频合帧：小块PCM合并为frame_ms时长的帧发送，缓冲最多停留max_hold_ms
+audio_coalesce_config = {
+    "frame_ms": 200,
+    "max_hold_ms": 250,
+}
+
+# 上游连接池：预先完成StartConnection的连接数量范围及空闲过期时间（秒）
+connection_pool_config = {
+    "min_size": 2,
+    "max_size": 8,
+    "idle_timeout": 60,
+    "sessions_per_connection": 1,    # 大于1时多个会话复用同一条上游连接
+}
+
+# 上行发送队列：音频排队超过latency_budget_ms即丢弃，最多缓存max_queue个音频帧，控制帧不丢弃
+send_queue_config = {
+    "max_queue": 50,
+    "latency_budget_ms": 1000,
+}
+
+# 上游断线自动重连：指数退避重试，续接原dialog_id，并重放当前语句最近replay_ms的麦克风音频
+reconnect_config = {
+    "enabled": True,
+    "max_attempts": 5,
+    "initial_delay": 0.5,
+    "max_delay": 8.0,
+    "replay_ms": 2000,
+}
+
+# 上游连接心跳：每interval秒ping一次并统计最近window次RTT，timeout秒无pong即判定连接失效
+heartbeat_config = {
+    "enabled": True,
+    "interval": 5.0,
+    "timeout": 5.0,
+    "window": 12,
+}
+
+# 对话轮次延迟时间线：每轮结束输出各阶段耗时；export_path不为空时每轮追加一行JSON
+latency_config = {
+    "enabled": True,
+    "export_path": None,
+}
+
+# 事件循环监控：每interval秒采样唤醒延迟；阻塞超过slow_threshold秒时记录调用栈；每report_interval秒输出分位数
+loop_monitor_config = {
+    "interval": 0.1,
+    "slow_threshold": 0.1,
+    "report_interval": 60,
+    "window": 600,
+    "max_snapshots": 20,
+}
+
+# TTS播放抖动缓冲（毫秒）
+# prefill_ms: 每段回复缓冲到该时长才开始播放
+# low_watermark_ms: 播放中途缓冲耗尽后，重新缓冲到该时长再继续
+# high_watermark_ms: 缓冲超过该时长时丢弃最旧的音频
+# period_ms: 音频回调周期
+# capacity_ms: 环形缓冲容量，写满后丢弃新音频
+# abort_on_interrupt: 打断时中止输出流，连同声卡中已缓冲的音频一起丢弃
+playback_config = {
+    "prefill_ms": 120,
+    "low_watermark_ms": 60,
+    "high_watermark_ms": 30000,
+    "period_ms": 20,
+    "capacity_ms": 60000,
+    "abort_on_interrupt": True,
+}
+
+# TTS输出录音：后台线程流式写入path，扩展名为.wav时写WAV，否则写裸PCM
+# max_bytes / max_seconds 不为0时按文件大小（字节）/ 时长（秒）轮转为 name_0001.wav 等多个文件
+output_recording_config = {
+    "enabled": True,
+    "path": "output.pcm",
+    "max_bytes": 0,
+    "max_seconds": 0,
+}
+
+# 麦克风输入录音：关闭时不做任何磁盘I/O；开启时连续写入WAV，默认每10分钟轮转一个文件
+input_recording_config = {
+    "enabled": False,
+    "path": "input.wav",
+    "max_bytes": 0,
+    "max_seconds": 600,
+}
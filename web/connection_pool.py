@@ -0,0 +1,197 @@
+"""
+上游连接池
+预先建立若干已完成StartConnection的豆包WebSocket连接，浏览器接入时直接取用，
+省去TLS握手和StartConnection往返；后台任务负责补充连接并淘汰闲置过久的连接。
+sessions_per_connection大于1时启用多路复用，多个会话共享同一条连接（DialogConnection）。
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from realtime_dialog_client import RealtimeDialogClient, DialogConnection
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamConnectionPool:
+    """
+    预热连接池
+    min_size: 保持的空闲预热连接数（多路复用时为保持的连接数）
+    max_size: 空闲连接与正在建立的连接总数上限（多路复用时为连接总数上限）
+    idle_timeout: 空闲连接最长保留秒数，超时关闭并重新建立
+    sessions_per_connection: 每条连接承载的会话数上限，1表示不复用
+    """
+
+    def __init__(self, ws_config: Dict[str, Any], min_size: int = 2, max_size: int = 8,
+                 idle_timeout: float = 60.0, refill_interval: float = 1.0, sessions_per_connection: int = 1):
+        if min_size > max_size:
+            raise ValueError("min_size must not exceed max_size")
+        self.ws_config = ws_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.refill_interval = refill_interval
+        self.sessions_per_connection = sessions_per_connection
+        self.hits = 0
+        self.misses = 0
+        self._idle: Deque[Tuple[RealtimeDialogClient, float]] = deque()
+        self._opening = 0
+        self._connections: List[DialogConnection] = []
+        self._connection_idle_since: Dict[DialogConnection, float] = {}
+        self._connection_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    @property
+    def connection_count(self) -> int:
+        """多路复用时的连接数"""
+        return len(self._connections)
+
+    def _new_client(self) -> RealtimeDialogClient:
+        return RealtimeDialogClient(config=self.ws_config, session_id=str(uuid.uuid4()))
+
+    async def start(self) -> None:
+        """启动后台补充任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._maintain())
+            logger.info(f"上游连接池已启动: min={self.min_size}, max={self.max_size}")
+
+    async def stop(self) -> None:
+        """停止后台任务并关闭所有空闲连接"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._idle:
+            client, _ = self._idle.popleft()
+            await self._close(client)
+        for connection in self._connections:
+            await self._close(connection)
+        self._connections.clear()
+        self._connection_idle_since.clear()
+
+    async def acquire(self) -> RealtimeDialogClient:
+        """取出一个已完成StartConnection的客户端；池为空时现场建立"""
+        if self.sessions_per_connection > 1:
+            return await self._acquire_session()
+        now = time.monotonic()
+        while self._idle:
+            client, created_at = self._idle.popleft()
+            if now - created_at > self.idle_timeout or not client.is_open():
+                asyncio.create_task(self._close(client))
+                continue
+            self.hits += 1
+            self._wakeup.set()
+            return client
+        self.misses += 1
+        self._wakeup.set()
+        client = self._new_client()
+        await client.start_connection()
+        return client
+
+    async def _acquire_session(self) -> RealtimeDialogClient:
+        """在有空余容量的复用连接上创建会话，没有则新建连接"""
+        async with self._connection_lock:
+            for connection in self._connections:
+                if connection.is_open() and connection.session_count < self.sessions_per_connection:
+                    self.hits += 1
+                    self._wakeup.set()
+                    return connection.create_session()
+            self.misses += 1
+            connection = DialogConnection(self.ws_config)
+            await connection.open()
+            self._connections.append(connection)
+        self._wakeup.set()
+        return connection.create_session()
+
+    async def _maintain(self) -> None:
+        while True:
+            if self.sessions_per_connection > 1:
+                self._maintain_connections()
+            else:
+                self._expire_idle()
+                while len(self._idle) + self._opening < self.min_size and \
+                        len(self._idle) + self._opening < self.max_size:
+                    self._opening += 1
+                    asyncio.create_task(self._open_one())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _open_one(self) -> None:
+        client = self._new_client()
+        try:
+            await client.start_connection()
+            self._idle.append((client, time.monotonic()))
+        except Exception as e:
+            logger.error(f"预热上游连接失败: {e}")
+            await self._close(client)
+            # 避免上游不可用时频繁重试
+            await asyncio.sleep(self.refill_interval)
+        finally:
+            self._opening -= 1
+
+    async def _open_connection(self) -> None:
+        connection = DialogConnection(self.ws_config)
+        try:
+            await connection.open()
+            self._connections.append(connection)
+        except Exception as e:
+            logger.error(f"预热复用连接失败: {e}")
+            await self._close(connection)
+            await asyncio.sleep(self.refill_interval)
+        finally:
+            self._opening -= 1
+
+    def _maintain_connections(self) -> None:
+        """淘汰断开或闲置过久的复用连接，没有空余容量时预先建立新连接"""
+        now = time.monotonic()
+        spare = 0
+        for connection in list(self._connections):
+            expired = False
+            if connection.session_count == 0:
+                idle_since = self._connection_idle_since.setdefault(connection, now)
+                expired = now - idle_since > self.idle_timeout and len(self._connections) > self.min_size
+            else:
+                self._connection_idle_since.pop(connection, None)
+            if expired or not connection.is_open():
+                self._connections.remove(connection)
+                self._connection_idle_since.pop(connection, None)
+                asyncio.create_task(self._close(connection))
+                continue
+            if connection.session_count < self.sessions_per_connection:
+                spare += 1
+        total = len(self._connections) + self._opening
+        while total < self.max_size and (total < self.min_size or (spare == 0 and self._opening == 0)):
+            self._opening += 1
+            total += 1
+            spare += 1
+            asyncio.create_task(self._open_connection())
+
+    def _expire_idle(self) -> None:
+        now = time.monotonic()
+        while self._idle:
+            client, created_at = self._idle[0]
+            if now - created_at <= self.idle_timeout and client.is_open():
+                break
+            self._idle.popleft()
+            asyncio.create_task(self._close(client))
+
+    @staticmethod
+    async def _close(client) -> None:
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning(f"关闭上游连接失败: {e}")
@@ -0,0 +1,133 @@
+"""
+事件循环延迟监控与慢回调检测
+循环内的采样任务每interval秒记录一次唤醒延迟；独立的看门狗线程发现采样任务迟迟未被唤醒
+（事件循环被某个回调或协程步骤阻塞超过slow_threshold）时，抓取事件循环线程当时的调用栈，
+循环恢复后连同实际阻塞时长一起记录为一条慢回调，用于定位阻塞事件循环的代码路径。
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import latency
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """
+    interval: 采样间隔（秒）
+    slow_threshold: 阻塞超过该时长即抓取调用栈（秒）
+    report_interval: 日志输出延迟分位数的间隔（秒），0为不输出
+    window: 计算分位数的最近样本数
+    max_snapshots: 保留的慢回调记录数
+    """
+
+    def __init__(self, interval: float = 0.1, slow_threshold: float = 0.1, report_interval: float = 60.0,
+                 window: int = 600, max_snapshots: int = 20):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.report_interval = report_interval
+        self.last = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=window)
+        self.histogram = latency.Histogram()
+        self.slow_callbacks = 0
+        self.snapshots: Deque[Dict[str, Any]] = deque(maxlen=max_snapshots)
+        self._tick = 0
+        self._tick_at = 0.0
+        self._pending: Optional[Dict[str, Any]] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._tick_at = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def percentile(self, q: float) -> Optional[float]:
+        """最近window个样本的延迟分位数（秒）"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    async def _run(self) -> None:
+        reported_at = time.monotonic()
+        while True:
+            self._tick += 1
+            self._tick_at = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last = max(0.0, now - self._tick_at - self.interval)
+            self.max = max(self.max, self.last)
+            self.samples.append(self.last)
+            self.histogram.observe(self.last)
+            pending, self._pending = self._pending, None
+            if pending is not None and pending["tick"] == self._tick:
+                self._record_slow(pending, self.last)
+            if self.report_interval and now - reported_at >= self.report_interval:
+                reported_at = now
+                self._report()
+
+    def _watch(self) -> None:
+        """看门狗线程：采样任务超时未被唤醒时抓取事件循环线程的调用栈"""
+        captured_tick = 0
+        while not self._stopped.wait(self.slow_threshold / 2):
+            tick = self._tick
+            stalled = time.monotonic() - self._tick_at - self.interval
+            if stalled < self.slow_threshold or tick == captured_tick:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            captured_tick = tick
+            task = asyncio.current_task(self._loop) if self._loop is not None else None
+            self._pending = {
+                "tick": tick,
+                "task": task.get_name() if task is not None else None,
+                "stack": "".join(traceback.format_stack(frame)),
+            }
+
+    def _record_slow(self, pending: Dict[str, Any], lag: float) -> None:
+        self.slow_callbacks += 1
+        snapshot = {
+            "at": time.time(),
+            "blocked_seconds": lag,
+            "task": pending["task"],
+            "stack": pending["stack"],
+        }
+        self.snapshots.append(snapshot)
+        logger.warning(f"事件循环被阻塞 {lag * 1000:.0f}ms (task={pending['task']})，阻塞时的调用栈:\n"
+                       f"{pending['stack']}")
+
+    def _report(self) -> None:
+        values = [self.percentile(q) for q in (50, 90, 99)]
+        logger.info("事件循环延迟(ms): p50={:.1f} p90={:.1f} p99={:.1f} max={:.1f} 慢回调={}".format(
+            *(value * 1000 for value in values), self.max * 1000, self.slow_callbacks))
+
+    def recent_snapshots(self) -> List[Dict[str, Any]]:
+        return list(self.snapshots)
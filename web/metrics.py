@@ -0,0 +1,64 @@
+"""
+Prometheus文本格式指标
+计数器都是普通整数，只在事件循环线程内累加，不加锁；抓取/metrics时才汇总各会话的瞬时值并生成文本。
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import latency
+
+# 浏览器侧收发计数
+browser_messages_in = 0
+browser_messages_out = 0
+browser_bytes_in = 0
+browser_bytes_out = 0
+
+# 会话初始化（取连接 + StartSession）耗时
+handshake_seconds = latency.Histogram()
+
+
+def count_browser_in(size: int) -> None:
+    global browser_messages_in, browser_bytes_in
+    browser_messages_in += 1
+    browser_bytes_in += size
+
+
+def count_browser_out(size: int) -> None:
+    global browser_messages_out, browser_bytes_out
+    browser_messages_out += 1
+    browser_bytes_out += size
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class Exposition:
+    """按Prometheus文本格式逐项拼接指标"""
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help_text: str,
+               samples: Iterable[Tuple[Optional[Dict[str, str]], float]]) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{_labels(labels)} {value}")
+
+    def histogram(self, name: str, help_text: str,
+                  histograms: Iterable[Tuple[Optional[Dict[str, str]], latency.Histogram]]) -> None:
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in histograms:
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                self.lines.append(f"{name}_bucket{_labels({**(labels or {}), 'le': repr(bound)})} {cumulative}")
+            self.lines.append(f"{name}_bucket{_labels({**(labels or {}), 'le': '+Inf'})} {histogram.count}")
+            self.lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+            self.lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    def render(self) -> str:
+        return "\n".join(self.lines) + "\n"
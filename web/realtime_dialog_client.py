@@ -1,23 +1,95 @@
+import asyncio
+import random
+import time
+import uuid
 import websockets
-import gzip
-import json
 
-from typing import Dict, Any
+from collections import deque
+from typing import Dict, Any, Optional, Callable, Awaitable, AsyncIterator, FrozenSet, Iterable, List
 
 import protocol
 import config
+import serialization
+
+
+class TrafficStats:
+    """进程级上游流量计数，只在事件循环线程内累加，不加锁"""
+
+    def __init__(self):
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.raw_payload_bytes = 0         # 压缩前payload字节数
+        self.compressed_payload_bytes = 0  # 压缩后payload字节数
+        self.dropped_audio_frames = 0
+        self.reconnects = 0
+
+
+traffic = TrafficStats()
+
+
+def create_compressors(policy: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, protocol.Compressor]:
+    """按消息类型（audio/control/text）创建压缩器，未指定的类型沿用config.compression_config"""
+    merged = dict(config.compression_config)
+    if policy:
+        merged.update(policy)
+    return {kind: protocol.Compressor(**options) for kind, options in merged.items()}
+
+
+def create_reconnect_policy(policy: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """合并断线重连策略，未指定的项沿用config.reconnect_config"""
+    merged = dict(config.reconnect_config)
+    if policy:
+        merged.update(policy)
+    # 重放缓冲按输入音频格式（16bit PCM）换算为字节数
+    bytes_per_second = config.input_audio_config["sample_rate"] * config.input_audio_config["channels"] * 2
+    merged["replay_bytes"] = int(bytes_per_second * merged["replay_ms"] / 1000)
+    return merged
 
 
 class RealtimeDialogClient:
-    def __init__(self, config: Dict[str, Any], session_id: str):
+    def __init__(self, config: Dict[str, Any], session_id: str,
+                 compression: Optional[Dict[str, Dict[str, Any]]] = None,
+                 reconnect: Optional[Dict[str, Any]] = None):
         self.config = config
         self.logid = ""
         self.session_id = session_id
+        self.encoder = protocol.FrameEncoder(session_id)
+        self.compressors = create_compressors(compression)
+        self.decoder = protocol.FrameDecoder()
+        self.received_frames = deque()
         self.ws = None
+        # 多路复用时由DialogConnection分发帧到inbox，ws为共享连接
+        self.connection: Optional["DialogConnection"] = None
+        self.inbox: Optional[asyncio.Queue] = None
+        self.dropped_frames = 0
+        # 启用后请求经由后台发送队列异步发出
+        self.sender: Optional["UpstreamSender"] = None
+        # 断线重连：同一dialog_id续接会话，并重放当前语句最近发出的音频
+        self.reconnect_policy = create_reconnect_policy(reconnect)
+        self.dialog_id = ""
+        self.session_active = False
+        self.reconnects = 0
+        self.replayed_bytes = 0
+        self._closing = False
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._replay = deque()
+        self._replay_size = 0
+        # 连接级心跳与RTT统计；多路复用的会话读取共享连接上的心跳
+        self.heartbeat: Optional["ConnectionHeartbeat"] = None
 
     async def connect(self) -> None:
-        """建立WebSocket连接"""
+        """建立WebSocket连接并开始会话"""
+        await self.start_connection()
+        await self.start_session()
+
+    async def start_connection(self) -> None:
+        """建立WebSocket连接并完成StartConnection"""
         print(f"url: {self.config['base_url']}, headers: {self.config['headers']}")
+        if self.heartbeat is not None:
+            await self.heartbeat.stop()
+            self.heartbeat = None
         self.ws = await websockets.connect(
             self.config['base_url'],
             additional_headers=self.config['headers'],
@@ -33,44 +105,43 @@ class RealtimeDialogClient:
         print(f"dialog server response logid: {self.logid}")
 
         # StartConnection request
-        start_connection_request = bytearray(protocol.generate_header())
-        start_connection_request.extend(int(1).to_bytes(4, 'big'))
-        payload_bytes = str.encode("{}")
-        payload_bytes = gzip.compress(payload_bytes)
-        start_connection_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        start_connection_request.extend(payload_bytes)
-        await self.ws.send(start_connection_request)
+        compression_type, payload_bytes = self.compressors["control"].compress(str.encode("{}"))
+        await self.ws.send(self.encoder.encode(1, payload_bytes, compression_type=compression_type,
+                                               with_session=False))
         response = await self.ws.recv()
         print(f"StartConnection response: {protocol.parse_response(response)}")
+        if config.heartbeat_config["enabled"]:
+            self.heartbeat = ConnectionHeartbeat(self.ws, interval=config.heartbeat_config["interval"],
+                                                 timeout=config.heartbeat_config["timeout"],
+                                                 window=config.heartbeat_config["window"])
+            self.heartbeat.start()
 
-        # StartSession request
+    async def start_session(self, timeout: float = 10.0) -> None:
+        """在已建立的连接上发起StartSession，timeout秒内未收到响应或收到错误帧时抛出异常"""
         request_params = config.start_session_req
-        payload_bytes = str.encode(json.dumps(request_params))
-        payload_bytes = gzip.compress(payload_bytes)
-        start_session_request = bytearray(protocol.generate_header())
-        start_session_request.extend(int(100).to_bytes(4, 'big'))
-        start_session_request.extend((len(self.session_id)).to_bytes(4, 'big'))
-        start_session_request.extend(str.encode(self.session_id))
-        start_session_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        start_session_request.extend(payload_bytes)
-        await self.ws.send(start_session_request)
-        response = await self.ws.recv()
-        print(f"StartSession response: {protocol.parse_response(response)}")
+        if self.dialog_id:
+            # 重连后沿用原dialog_id，服务端据此续接对话上下文
+            request_params = dict(request_params)
+            request_params["dialog"] = dict(request_params.get("dialog", {}), dialog_id=self.dialog_id)
+        # 经_write发送，多路复用时记录为最近发出请求的会话，StartSession的错误响应才能回到本会话
+        await self._write(100, serialization.dumps(request_params), "control")
+        try:
+            response = await asyncio.wait_for(self.receive_server_response(), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise Exception(f"StartSession response timed out after {timeout}s")
+        print(f"StartSession response: {response}")
+        if response and response.message_type == 'SERVER_ERROR_RESPONSE':
+            raise Exception(f"StartSession failed: code={response.code}, {response.payload}")
+        if response and response.event == 150 and isinstance(response.payload, dict):
+            self.dialog_id = response.payload.get("dialog_id", self.dialog_id)
+        self.session_active = True
 
     async def say_hello(self) -> None:
         """发送Hello消息"""
         payload = {
             "content": "你好，我是豆包，有什么可以帮助你的？",
         }
-        hello_request = bytearray(protocol.generate_header())
-        hello_request.extend(int(300).to_bytes(4, 'big'))
-        payload_bytes = str.encode(json.dumps(payload))
-        payload_bytes = gzip.compress(payload_bytes)
-        hello_request.extend((len(self.session_id)).to_bytes(4, 'big'))
-        hello_request.extend(str.encode(self.session_id))
-        hello_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        hello_request.extend(payload_bytes)
-        await self.ws.send(hello_request)
+        await self.send_frame(300, serialization.dumps(payload), "text")
 
     async def chat_tts_text(self, is_user_querying: bool, start: bool, end: bool, content: str) -> None:
         if is_user_querying:
@@ -82,61 +153,661 @@ class RealtimeDialogClient:
             "content": content,
         }
         print(f"ChatTTSTextRequest payload: {payload}")
-        payload_bytes = str.encode(json.dumps(payload))
-        payload_bytes = gzip.compress(payload_bytes)
-
-        chat_tts_text_request = bytearray(protocol.generate_header())
-        chat_tts_text_request.extend(int(500).to_bytes(4, 'big'))
-        chat_tts_text_request.extend((len(self.session_id)).to_bytes(4, 'big'))
-        chat_tts_text_request.extend(str.encode(self.session_id))
-        chat_tts_text_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        chat_tts_text_request.extend(payload_bytes)
-        await self.ws.send(chat_tts_text_request)
+        await self.send_frame(500, serialization.dumps(payload), "text")
 
     async def task_request(self, audio: bytes) -> None:
-        task_request = bytearray(
-            protocol.generate_header(message_type=protocol.CLIENT_AUDIO_ONLY_REQUEST,
-                                     serial_method=protocol.NO_SERIALIZATION))
-        task_request.extend(int(200).to_bytes(4, 'big'))
-        task_request.extend((len(self.session_id)).to_bytes(4, 'big'))
-        task_request.extend(str.encode(self.session_id))
-        payload_bytes = gzip.compress(audio)
-        task_request.extend((len(payload_bytes)).to_bytes(4, 'big'))  # payload size(4 bytes)
-        task_request.extend(payload_bytes)
-        await self.ws.send(task_request)
-
-    async def receive_server_response(self) -> Dict[str, Any]:
+        await self.send_frame(200, audio, "audio",
+                              message_type=protocol.CLIENT_AUDIO_ONLY_REQUEST,
+                              serial_method=protocol.NO_SERIALIZATION)
+
+    async def write_frame(self, event: int, payload: bytes, kind: str, with_session: bool = True, **header) -> None:
+        """按kind对应的压缩策略压缩、编码并立即发送一帧；连接断开时重连后重发"""
         try:
-            response = await self.ws.recv()
-            data = protocol.parse_response(response)
+            await self._write(event, payload, kind, with_session, **header)
+        except Exception:
+            if not await self._recover():
+                raise
+            await self._write(event, payload, kind, with_session, **header)
+
+    async def _write(self, event: int, payload: bytes, kind: str, with_session: bool = True, **header) -> None:
+        reconnecting = self._reconnect_task
+        if reconnecting is not None and not reconnecting.done() and asyncio.current_task() is not reconnecting:
+            # 重连时新socket先于StartSession完成就已换上，等会话续接后再发送，避免发到服务端未知的会话
+            await asyncio.wait({reconnecting})
+        compression_type, payload_bytes = self.compressors[kind].compress(payload)
+        frame = self.encoder.encode(event, payload_bytes, compression_type=compression_type,
+                                    with_session=with_session, **header)
+        await self.ws.send(frame)
+        if self.connection is not None:
+            self.connection.last_sender = self.session_id
+        traffic.frames_out += 1
+        traffic.bytes_out += len(frame)
+        traffic.raw_payload_bytes += len(payload)
+        traffic.compressed_payload_bytes += len(payload_bytes)
+        if event == 200:
+            self._remember_audio(payload)
+
+    def _remember_audio(self, audio: bytes) -> None:
+        """记录已发出的音频，只保留最近replay_ms以内的部分"""
+        limit = self.reconnect_policy["replay_bytes"]
+        if limit <= 0:
+            return
+        self._replay.append(audio)
+        self._replay_size += len(audio)
+        while self._replay_size > limit and len(self._replay) > 1:
+            self._replay_size -= len(self._replay.popleft())
+
+    def _can_resume(self) -> bool:
+        return (self.reconnect_policy["enabled"] and self.connection is None
+                and self.session_active and not self._closing)
+
+    async def _recover(self) -> bool:
+        """发送或接收失败时调用，返回是否已重连成功"""
+        if not self._can_resume() or asyncio.current_task() is self._reconnect_task:
+            return False
+        return await self.reconnect()
+
+    async def reconnect(self) -> bool:
+        """重新建立连接并续接会话；并发调用共享同一次重连"""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+        return await asyncio.shield(self._reconnect_task)
+
+    async def _reconnect(self) -> bool:
+        delay = self.reconnect_policy["initial_delay"]
+        for attempt in range(1, self.reconnect_policy["max_attempts"] + 1):
+            print(f"Upstream connection lost, reconnecting (attempt {attempt})...")
+            try:
+                if self.ws is not None:
+                    await self.ws.close()
+                self.decoder = protocol.FrameDecoder()
+                self.received_frames.clear()
+                await self.start_connection()
+                await self.start_session()
+                await self._replay_audio()
+                self.reconnects += 1
+                traffic.reconnects += 1
+                print(f"Upstream session resumed, dialog_id: {self.dialog_id}")
+                return True
+            except Exception as e:
+                print(f"Reconnect attempt {attempt} failed: {e}")
+                if self._closing:
+                    break
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.reconnect_policy["max_delay"])
+        return False
+
+    async def _replay_audio(self) -> None:
+        """重放当前语句最近发出的音频，避免重连丢失正在说的话"""
+        chunks = list(self._replay)
+        self._replay.clear()
+        self._replay_size = 0
+        for audio in chunks:
+            await self._write(200, audio, "audio",
+                              message_type=protocol.CLIENT_AUDIO_ONLY_REQUEST,
+                              serial_method=protocol.NO_SERIALIZATION)
+            self.replayed_bytes += len(audio)
+
+    async def send_frame(self, event: int, payload: bytes, kind: str, with_session: bool = True,
+                         ordered: bool = False, **header) -> None:
+        """
+        启用发送队列时入队后立即返回，否则直接发送
+        非音频帧默认优先于排队音频发送，ordered=True时排在已入队音频之后
+        """
+        if self.sender is not None:
+            self.sender.put(event, payload, kind, with_session, ordered, **header)
+            return
+        await self.write_frame(event, payload, kind, with_session, **header)
+
+    def start_sender(self, max_queue: int = 50, latency_budget_ms: int = 1000) -> "UpstreamSender":
+        """启用后台发送队列（会话开始后调用）"""
+        if self.sender is None:
+            self.sender = UpstreamSender(self.write_frame, max_queue=max_queue, latency_budget_ms=latency_budget_ms)
+            self.sender.start()
+        return self.sender
+
+    def split_message(self, message: bytes) -> List[bytes]:
+        """把一条WebSocket消息切分为帧；长度字段与消息不符时丢弃残留字节，下一条消息重新对齐"""
+        resyncs = self.decoder.resyncs
+        frames = self.decoder.feed_message(message)
+        if self.decoder.resyncs != resyncs:
+            print(f"Frame length mismatch in a {len(message)} byte message, decoder reset "
+                  f"({self.decoder.discarded_bytes} bytes discarded so far)")
+        traffic.frames_in += len(frames)
+        traffic.bytes_in += len(message)
+        return frames
+
+    async def receive_server_response(self) -> Optional[protocol.ParsedFrame]:
+        try:
+            if self.inbox is not None:
+                frame = await self.inbox.get()
+                if isinstance(frame, Exception):
+                    raise frame
+                return frame
+            # 一条WebSocket消息可能包含多个帧，交给decoder按长度字段切分
+            while not self.received_frames:
+                try:
+                    response = await self.ws.recv()
+                except Exception:
+                    if not await self._recover():
+                        raise
+                    continue
+                if isinstance(response, str):
+                    return protocol.parse_response(response)
+                self.received_frames.extend(self.split_message(response))
+            data = protocol.parse_response(self.received_frames.popleft())
+            if data.event == 459:
+                # 语句已结束，之前的音频无需重放
+                self._replay.clear()
+                self._replay_size = 0
+            elif data.event in (152, 153):
+                self.session_active = False
             return data
         except Exception as e:
             raise Exception(f"Failed to receive message: {e}")
 
+    async def events(self, kinds: Optional[Iterable[str]] = None,
+                     events: Optional[Iterable[int]] = None) -> AsyncIterator[protocol.ParsedFrame]:
+        """
+        异步迭代服务端事件，收到会话结束事件（152/153）后结束迭代
+        kinds: 只接收这些message_type，如{'SERVER_ACK', 'SERVER_FULL_RESPONSE'}
+        events: 只接收这些事件号；错误帧不带事件号，不受此过滤
+        未订阅的帧只解析了帧头，payload不会被解码
+        """
+        kinds = frozenset(kinds) if kinds is not None else None
+        events = frozenset(events) if events is not None else None
+        while True:
+            frame = await self.receive_server_response()
+            if frame is None:
+                continue
+            finished = frame.event in (152, 153)
+            if (kinds is None or frame.message_type in kinds) and \
+                    (events is None or frame.event in events or frame.message_type == 'SERVER_ERROR_RESPONSE'):
+                yield frame
+            if finished:
+                return
+
+    def deliver(self, frame) -> None:
+        """由DialogConnection调用，将分发给本会话的帧（或连接异常）放入inbox；队列满时丢弃最旧的帧"""
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            self.dropped_frames += 1
+        self.inbox.put_nowait(frame)
+
     async def finish_session(self):
-        finish_session_request = bytearray(protocol.generate_header())
-        finish_session_request.extend(int(102).to_bytes(4, 'big'))
-        payload_bytes = str.encode("{}")
-        payload_bytes = gzip.compress(payload_bytes)
-        finish_session_request.extend((len(self.session_id)).to_bytes(4, 'big'))
-        finish_session_request.extend(str.encode(self.session_id))
-        finish_session_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        finish_session_request.extend(payload_bytes)
-        await self.ws.send(finish_session_request)
+        self.session_active = False
+        await self.send_frame(102, str.encode("{}"), "control")
 
     async def finish_connection(self):
-        finish_connection_request = bytearray(protocol.generate_header())
-        finish_connection_request.extend(int(2).to_bytes(4, 'big'))
-        payload_bytes = str.encode("{}")
-        payload_bytes = gzip.compress(payload_bytes)
-        finish_connection_request.extend((len(payload_bytes)).to_bytes(4, 'big'))
-        finish_connection_request.extend(payload_bytes)
-        await self.ws.send(finish_connection_request)
-        response = await self.ws.recv()
-        print(f"FinishConnection response: {protocol.parse_response(response)}")
+        self._closing = True
+        compression_type, payload_bytes = self.compressors["control"].compress(str.encode("{}"))
+        await self.ws.send(self.encoder.encode(2, payload_bytes, compression_type=compression_type,
+                                               with_session=False))
+        response = await self.receive_server_response()
+        print(f"FinishConnection response: {response}")
+
+    async def _finish_and_drain(self) -> None:
+        await self.finish_session()
+        if self.sender is not None:
+            await self.sender.drain()
+
+    def is_open(self) -> bool:
+        """WebSocket连接是否仍然可用"""
+        return self.ws is not None and self.ws.close_code is None
+
+    @property
+    def rtt(self) -> Optional[float]:
+        """上游连接的滚动平均RTT（秒），未启用心跳或尚无样本时为None"""
+        heartbeat = self.connection.client.heartbeat if self.connection is not None else self.heartbeat
+        return heartbeat.avg_rtt if heartbeat is not None else None
 
     async def close(self) -> None:
-        """关闭WebSocket连接"""
+        """关闭WebSocket连接；多路复用的会话结束上游会话后只从连接上解除，不关闭共享连接"""
+        self._closing = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self.connection is not None and self.session_active and self.connection.is_open():
+            # 共享连接不会随会话关闭，需显式结束上游会话，否则服务端会话一直存活
+            try:
+                await asyncio.wait_for(self._finish_and_drain(), timeout=5)
+            except Exception as e:
+                print(f"FinishSession on shared connection failed: {e}")
+        if self.heartbeat is not None:
+            await self.heartbeat.stop()
+        if self.sender is not None:
+            await self.sender.stop()
+        if self.connection is not None:
+            self.connection.detach(self)
+            return
         if self.ws:
             print(f"Closing WebSocket connection...")
             await self.ws.close()
+
+
+EventHandler = Callable[[protocol.ParsedFrame], Optional[Awaitable[None]]]
+
+
+class EventDispatcher:
+    """
+    事件分发表：事件号 -> 处理函数，按事件号O(1)查找，处理函数可以是普通函数或协程函数
+    error处理SERVER_ERROR_RESPONSE；default处理未注册的事件，为None时未注册的事件在解码payload前即被丢弃
+    watch注册的观察者（如延迟统计）在处理函数之前同步调用，不影响事件的处理
+    """
+
+    def __init__(self):
+        self.handlers: Dict[int, EventHandler] = {}
+        self.watchers: Dict[int, List[Callable[[protocol.ParsedFrame], None]]] = {}
+        self.error: Optional[EventHandler] = None
+        self.default: Optional[EventHandler] = None
+
+    def on(self, event: int, handler: EventHandler) -> None:
+        self.handlers[event] = handler
+
+    def watch(self, events: Iterable[int], callback: Callable[[protocol.ParsedFrame], None]) -> None:
+        for event in events:
+            self.watchers.setdefault(event, []).append(callback)
+
+    def on_error(self, handler: EventHandler) -> None:
+        self.error = handler
+
+    def on_default(self, handler: EventHandler) -> None:
+        self.default = handler
+
+    def subscribed(self) -> Optional[FrozenSet[int]]:
+        """需要接收的事件号，None表示全部接收"""
+        if self.default is not None:
+            return None
+        return frozenset(self.handlers) | frozenset(self.watchers)
+
+    async def dispatch(self, frame: protocol.ParsedFrame) -> None:
+        if frame.message_type == 'SERVER_ERROR_RESPONSE':
+            handler = self.error
+        else:
+            watchers = self.watchers.get(frame.event)
+            if watchers:
+                for watcher in watchers:
+                    watcher(frame)
+            handler = self.handlers.get(frame.event, self.default)
+        if handler is None:
+            return
+        result = handler(frame)
+        if result is not None:
+            await result
+
+    async def run(self, client: "RealtimeDialogClient") -> None:
+        """持续接收并分发事件，直到会话结束"""
+        async for frame in client.events(events=self.subscribed()):
+            await self.dispatch(frame)
+
+
+class UpstreamSender:
+    """
+    会话级上行发送任务
+    请求只放入队列即返回，由后台任务依次编码发送，上游阻塞时不会拖住麦克风采集或浏览器接收循环。
+    控制/文本帧（100、102、300、500、2）优先于排队中的音频发送；ordered=True的控制帧则排在已入队音频之后。
+    音频在队列中等待超过latency_budget_ms即被丢弃；音频数量达到max_queue时丢弃最旧的音频。
+    控制帧从不丢弃；优先发出的结束帧（102、2）会清空其后排队的音频。
+    """
+
+    FINISH_EVENTS = frozenset((102, 2))
+
+    def __init__(self, write: Callable[..., Awaitable[None]], max_queue: int = 50, latency_budget_ms: int = 1000):
+        self.write = write
+        self.max_queue = max_queue
+        self.latency_budget = latency_budget_ms / 1000
+        self.sent_frames = 0
+        self.dropped_audio_frames = 0
+        self.dropped_audio_bytes = 0
+        self.send_errors = 0
+        self.max_depth = 0
+        # (入队时间, event, payload, kind, with_session, header)
+        self._control = deque()
+        self._audio = deque()
+        self._audio_count = 0
+        self._sending = False
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def depth(self) -> int:
+        """当前排队的帧数"""
+        return len(self._control) + len(self._audio)
+
+    @property
+    def audio_depth(self) -> int:
+        """当前排队的音频帧数"""
+        return self._audio_count
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def drain(self) -> None:
+        """等待队列中的帧全部发出"""
+        while (self.depth or self._sending) and self._task is not None and not self._task.done():
+            await asyncio.sleep(0.01)
+
+    def put(self, event: int, payload: bytes, kind: str, with_session: bool = True,
+            ordered: bool = False, **header) -> None:
+        item = (time.monotonic(), event, payload, kind, with_session, header)
+        if kind == "audio":
+            if self._audio_count >= self.max_queue:
+                self._drop_oldest_audio()
+            self._audio_count += 1
+            self._audio.append(item)
+        elif ordered:
+            self._audio.append(item)
+        else:
+            self._control.append(item)
+        if self.depth > self.max_depth:
+            self.max_depth = self.depth
+        self._wakeup.set()
+
+    def _drop_oldest_audio(self) -> None:
+        for index, item in enumerate(self._audio):
+            if item[3] == "audio":
+                del self._audio[index]
+                self._drop(item)
+                return
+
+    def _drop(self, item) -> None:
+        self._audio_count -= 1
+        self.dropped_audio_frames += 1
+        traffic.dropped_audio_frames += 1
+        self.dropped_audio_bytes += len(item[2])
+
+    def _discard_audio(self) -> None:
+        """丢弃排队中的音频，保留按序排队的控制帧"""
+        kept = deque()
+        for item in self._audio:
+            if item[3] == "audio":
+                self._drop(item)
+            else:
+                kept.append(item)
+        self._audio = kept
+
+    async def _run(self) -> None:
+        while True:
+            if self._control:
+                enqueued_at, event, payload, kind, with_session, header = self._control.popleft()
+                if event in self.FINISH_EVENTS:
+                    self._discard_audio()
+            elif self._audio:
+                enqueued_at, event, payload, kind, with_session, header = self._audio.popleft()
+                if kind == "audio":
+                    self._audio_count -= 1
+                    if time.monotonic() - enqueued_at > self.latency_budget:
+                        self.dropped_audio_frames += 1
+                        traffic.dropped_audio_frames += 1
+                        self.dropped_audio_bytes += len(payload)
+                        continue
+            else:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            self._sending = True
+            try:
+                await self.write(event, payload, kind, with_session, **header)
+                self.sent_frames += 1
+            except Exception as e:
+                self.send_errors += 1
+                print(f"Failed to send frame (event {event}): {e}")
+            finally:
+                self._sending = False
+
+
+class ConnectionHeartbeat:
+    """
+    上游连接心跳
+    每interval秒发送一次WebSocket ping并测量往返时延，保留最近window次的RTT样本；
+    timeout秒内未收到pong即认为连接已失效并强制关闭，使接收方尽快报错（并触发断线重连）。
+    """
+
+    def __init__(self, ws, interval: float = 5.0, timeout: float = 5.0, window: int = 12):
+        self.ws = ws
+        self.interval = interval
+        self.timeout = timeout
+        self.samples = deque(maxlen=window)
+        self.last_rtt: Optional[float] = None
+        self.pings = 0
+        self.timeouts = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def avg_rtt(self) -> Optional[float]:
+        """滚动平均RTT（秒），尚无样本时为None"""
+        if not self.samples:
+            return None
+        return sum(self.samples) / len(self.samples)
+
+    @property
+    def max_rtt(self) -> Optional[float]:
+        return max(self.samples) if self.samples else None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while self.ws.close_code is None:
+            await asyncio.sleep(self.interval)
+            started = time.monotonic()
+            try:
+                pong_waiter = await self.ws.ping()
+                await asyncio.wait_for(pong_waiter, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                print(f"Heartbeat timed out after {self.timeout}s, closing upstream connection")
+                await self._abort()
+                return
+            except Exception:
+                # 连接已关闭，由接收方处理
+                return
+            self.last_rtt = time.monotonic() - started
+            self.samples.append(self.last_rtt)
+            self.pings += 1
+
+    async def _abort(self) -> None:
+        """半开连接上正常关闭握手也会卡住，超时后直接断开传输层"""
+        try:
+            await asyncio.wait_for(self.ws.close(), timeout=self.timeout)
+        except Exception:
+            transport = getattr(self.ws, "transport", None)
+            if transport is not None:
+                transport.abort()
+
+
+class AudioCoalescer:
+    """
+    上行音频合帧器
+    将零碎的PCM块按时间窗口合并为frame_ms时长的TaskRequest帧再发送；
+    缓冲中最早的数据最多停留max_hold_ms，超时即使不足一帧也立即发送，保证延迟有界。
+    """
+
+    def __init__(self, send: Callable[[bytes], Awaitable[None]], frame_ms: int = 200, max_hold_ms: int = 250,
+                 sample_rate: int = 16000, channels: int = 1, sample_width: int = 2):
+        self.send = send
+        self.frame_bytes = sample_rate * channels * sample_width * frame_ms // 1000
+        self.max_hold = max_hold_ms / 1000
+        self.frames_sent = 0
+        self.chunks_received = 0
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def push(self, chunk: bytes) -> None:
+        """追加一块音频，凑满一帧即发送"""
+        self.chunks_received += 1
+        self._buffer += chunk
+        if len(self._buffer) >= self.frame_bytes:
+            self._cancel_timer()
+            async with self._lock:
+                while len(self._buffer) >= self.frame_bytes:
+                    frame = bytes(self._buffer[:self.frame_bytes])
+                    del self._buffer[:self.frame_bytes]
+                    await self._send(frame)
+        if self._buffer and self._flush_timer is None:
+            loop = asyncio.get_running_loop()
+            self._flush_timer = loop.call_later(self.max_hold, self._on_hold_timeout)
+
+    async def flush(self) -> None:
+        """立即发送缓冲中剩余的音频"""
+        self._cancel_timer()
+        async with self._lock:
+            if self._buffer:
+                frame = bytes(self._buffer)
+                self._buffer.clear()
+                await self._send(frame)
+
+    async def close(self) -> None:
+        self._cancel_flush_task()
+        await self.flush()
+
+    def discard(self) -> None:
+        """丢弃缓冲中的音频（例如停止对话时）"""
+        self._cancel_timer()
+        self._cancel_flush_task()
+        self._buffer.clear()
+
+    async def _send(self, frame: bytes) -> None:
+        self.frames_sent += 1
+        await self.send(frame)
+
+    def _on_hold_timeout(self) -> None:
+        self._flush_timer = None
+        # 事件循环只弱引用任务，需自己持有，避免尚未执行的flush被回收
+        self._flush_task = asyncio.ensure_future(self._flush_on_timeout())
+
+    async def _flush_on_timeout(self) -> None:
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Failed to flush coalesced audio: {e}")
+
+    def _cancel_timer(self) -> None:
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def _cancel_flush_task(self) -> None:
+        if self._flush_task is not None:
+            if not self._flush_task.done():
+                self._flush_task.cancel()
+            self._flush_task = None
+
+
+class DialogConnection:
+    """
+    多路复用的上游连接
+    一条WebSocket只做一次StartConnection，其上可并发运行多个会话（StartSession）；
+    后台读取任务按帧中的session_id把响应分发到各会话自己的队列。
+    错误帧不带session_id，交给最近发出请求的会话；该会话已解除时分发给所有会话。
+    """
+
+    def __init__(self, config: Dict[str, Any], compression: Optional[Dict[str, Dict[str, Any]]] = None,
+                 session_queue_size: int = 1024):
+        self.compression = compression
+        self.session_queue_size = session_queue_size
+        # 连接级请求（StartConnection/FinishConnection）使用的客户端，不带session ID
+        self.client = RealtimeDialogClient(config=config, session_id="", compression=compression)
+        self.sessions: Dict[str, RealtimeDialogClient] = {}
+        self.unrouted_frames = 0
+        self.last_sender: Optional[str] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    @property
+    def session_count(self) -> int:
+        return len(self.sessions)
+
+    def is_open(self) -> bool:
+        return self.client.is_open() and self._reader is not None and not self._reader.done()
+
+    async def open(self) -> None:
+        """建立WebSocket连接、完成StartConnection并启动分发任务"""
+        await self.client.start_connection()
+        self.client.inbox = asyncio.Queue(maxsize=self.session_queue_size)
+        self._reader = asyncio.create_task(self._read_loop())
+
+    def create_session(self, session_id: Optional[str] = None) -> RealtimeDialogClient:
+        """在本连接上创建会话客户端，调用方随后执行start_session()"""
+        session = RealtimeDialogClient(config=self.client.config, session_id=session_id or str(uuid.uuid4()),
+                                       compression=self.compression)
+        session.ws = self.client.ws
+        session.logid = self.client.logid
+        session.inbox = asyncio.Queue(maxsize=self.session_queue_size)
+        session.connection = self
+        self.sessions[session.session_id] = session
+        return session
+
+    def detach(self, session: RealtimeDialogClient) -> None:
+        """会话结束，不再接收分发的帧"""
+        self.sessions.pop(session.session_id, None)
+
+    async def close(self) -> None:
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        await self.client.close()
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                message = await self.client.ws.recv()
+                if isinstance(message, str):
+                    continue
+                for raw_frame in self.client.split_message(message):
+                    self._route(protocol.parse_response(raw_frame))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 连接断开，唤醒所有等待中的会话
+            for target in [self.client, *self.sessions.values()]:
+                target.deliver(e)
+
+    def _route(self, frame: protocol.ParsedFrame) -> None:
+        if frame.message_type == 'SERVER_ERROR_RESPONSE':
+            self._route_error(frame)
+            return
+        if frame.session_id is not None:
+            target = self.sessions.get(frame.session_id)
+        elif frame.event in protocol.SERVER_CONNECTION_EVENTS:
+            target = self.client
+        else:
+            target = None
+        if target is None:
+            self.unrouted_frames += 1
+            if frame.event not in (152, 153):
+                # 会话关闭时已解除，之后到达的SessionFinished无需提示
+                print(f"Dropping unrouted frame: {frame.message_type}, event={frame.event}, code={frame.code}")
+            return
+        target.deliver(frame)
+
+    def _route_error(self, frame: protocol.ParsedFrame) -> None:
+        target = self.sessions.get(self.last_sender) if self.last_sender is not None else None
+        if target is not None:
+            target.deliver(frame)
+            return
+        for target in list(self.sessions.values()) or [self.client]:
+            target.deliver(frame)
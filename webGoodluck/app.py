@@ -23,6 +23,7 @@ load_dotenv(parent_dir / '.env')
 from audio_manager import AudioDeviceManager, AudioConfig
 from realtime_dialog_client import RealtimeDialogClient
 import config as app_config
+import serialization
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -60,7 +61,7 @@ class ConnectionManager:
         if session_id in self.session_manager:
             websocket = self.session_manager[session_id].websocket
             try:
-                await websocket.send_json(message)
+                await websocket.send_text(serialization.dumps_str(message))
             except Exception as e:
                 logger.error(f"发送消息失败: {e}")
 
@@ -78,11 +79,11 @@ class WebSession:
     async def log_to_client(self, message: str, level: str = "info"):
         """向客户端发送日志"""
         try:
-            await self.websocket.send_json({
+            await self.websocket.send_text(serialization.dumps_str({
                 "type": "log",
                 "level": level,
                 "message": message
-            })
+            }))
         except Exception as e:
             logger.error(f"Failed to send log to client: {e}")
 
@@ -104,6 +105,7 @@ class WebSession:
             
             # 建立连接
             await self.client.connect()
+            self.client.start_sender(**app_config.send_queue_config)
             self.is_connected = True
             
             # 创建并启动后台监听任务
@@ -120,11 +122,12 @@ class WebSession:
     async def listen_for_responses(self):
         """后台持续监听来自豆包API的响应"""
         try:
+            # events()在会话结束事件后结束迭代，连接仍在时继续监听
             while self.is_connected:
-                response = await self.client.receive_server_response()
-                await self.log_to_client(f"收到服务端响应: {response.get('message_type')}")
-                # 将响应直接发给客户端
-                await self.websocket.send_json(response)
+                async for response in self.client.events():
+                    await self.log_to_client(f"收到服务端响应: {response.message_type}")
+                    # 将响应直接发给客户端
+                    await self.websocket.send_text(serialization.dumps_str(response.to_dict()))
         except WebSocketDisconnect:
             logger.info("客户端在监听时断开连接。")
         except Exception as e:
@@ -233,7 +236,7 @@ async def websocket_endpoint(websocket: WebSocket):
         
         while True:
             # 接收消息
-            data = await websocket.receive_json()
+            data = serialization.loads(await websocket.receive_text())
             
             if data["type"] == "audio":
                 # 处理音频数据
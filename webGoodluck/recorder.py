@@ -0,0 +1,158 @@
+"""
+音频流式录制
+事件循环只把音频块放入队列，后台线程带缓冲地顺序写入磁盘，内存占用与会话时长无关。
+支持裸PCM和WAV两种格式：WAV先写入长度为0的头部，轮转或关闭时回填RIFF/data长度。
+max_bytes / max_seconds 不为0时按文件大小 / 打开时长轮转，文件名依次为 name_0001.wav、name_0002.wav ...
+"""
+import os
+import queue
+import struct
+import threading
+import time
+from typing import BinaryIO, Optional
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAV_HEADER_SIZE = 44
+
+
+def wav_header(data_size: int, sample_rate: int, channels: int, sample_width: int, format_tag: int) -> bytes:
+    """44字节的RIFF/WAVE头部"""
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, format_tag, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+        b"data", data_size,
+    )
+
+
+class StreamingRecorder:
+    """
+    path: 输出文件路径，扩展名决定格式（.wav为WAV，其余为裸PCM）
+    sample_rate / channels / sample_width / float_samples: 音频格式，float_samples表示32位浮点采样
+    max_bytes: 单个文件的最大数据字节数，0为不限制
+    max_seconds: 单个文件的最长打开时长（秒），0为不限制
+    max_pending: 尚未写盘的最大字节数，超过时丢弃新音频
+    buffer_size: 文件写缓冲大小
+    """
+
+    def __init__(self, path: str, sample_rate: int, channels: int = 1, sample_width: int = 2,
+                 float_samples: bool = False, max_bytes: int = 0, max_seconds: float = 0,
+                 max_pending: int = 8 * 1024 * 1024, buffer_size: int = 256 * 1024):
+        self.path = path
+        self.wav = path.lower().endswith(".wav")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.format_tag = WAVE_FORMAT_IEEE_FLOAT if float_samples else WAVE_FORMAT_PCM
+        self.max_bytes = max_bytes - max_bytes % (channels * sample_width)
+        self.max_seconds = max_seconds
+        self.max_pending = max_pending
+        self.buffer_size = buffer_size
+        self.rotate = bool(max_bytes or max_seconds)
+        # enqueued_bytes/dropped_bytes只由调用write的线程更新，written_bytes等只由写线程更新
+        self.enqueued_bytes = 0
+        self.dropped_bytes = 0
+        self.written_bytes = 0
+        self.files = []
+        self.error: Optional[OSError] = None
+        self._queue: "queue.SimpleQueue[Optional[bytes]]" = queue.SimpleQueue()
+        self._file: Optional[BinaryIO] = None
+        self._file_bytes = 0
+        self._file_opened_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def pending_bytes(self) -> int:
+        return self.enqueued_bytes - self.dropped_bytes - self.written_bytes
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+            self._thread.start()
+
+    def write(self, data) -> None:
+        """追加一段音频，不做磁盘I/O"""
+        size = len(data)
+        self.enqueued_bytes += size
+        if self.error is not None or self.pending_bytes > self.max_pending:
+            self.dropped_bytes += size
+            return
+        self._queue.put(bytes(data))
+
+    def close(self) -> None:
+        """写完队列中的音频并关闭文件"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._write(data)
+            except OSError as e:
+                self.error = e
+                print(f"录音写入失败: {e}")
+        try:
+            self._close_file()
+        except OSError as e:
+            self.error = e
+            print(f"录音写入失败: {e}")
+
+    def _write(self, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            if self._file is None or self._should_rotate():
+                self._close_file()
+                self._open_file()
+            size = len(view)
+            if self.max_bytes:
+                size = min(size, self.max_bytes - self._file_bytes)
+            self._file.write(view[:size])
+            self._file_bytes += size
+            self.written_bytes += size
+            view = view[size:]
+
+    def _should_rotate(self) -> bool:
+        if not self.rotate:
+            return False
+        if self.max_bytes and self._file_bytes >= self.max_bytes:
+            return True
+        return bool(self.max_seconds and time.monotonic() - self._file_opened_at >= self.max_seconds)
+
+    def _file_path(self) -> str:
+        if not self.rotate:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}_{len(self.files) + 1:04d}{ext}"
+
+    def _open_file(self) -> None:
+        path = self._file_path()
+        self._file = open(path, "wb", buffering=self.buffer_size)
+        self._file_bytes = 0
+        self._file_opened_at = time.monotonic()
+        self.files.append(path)
+        if self.wav:
+            self._file.write(self._header(0))
+
+    def _close_file(self) -> None:
+        if self._file is None:
+            return
+        file, self._file = self._file, None
+        try:
+            if self.wav:
+                file.seek(0)
+                file.write(self._header(self._file_bytes))
+        finally:
+            file.close()
+
+    def _header(self, data_size: int) -> bytes:
+        return wav_header(data_size, self.sample_rate, self.channels, self.sample_width, self.format_tag)